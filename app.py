@@ -1,63 +1,137 @@
-from flask import Flask, request, jsonify, send_from_directory, redirect, url_for, session
+import time
+_import_started = time.perf_counter()
+
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, redirect, url_for, session
 from flask_cors import CORS
 import os
 import atexit
+import threading
+from datetime import date
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from google_auth_oauthlib.flow import Flow
-
+import backup_jobs
 import database_utils as db_utils
 import database_setup
 import gdrive_service
-
-app = Flask(__name__, static_folder='public', static_url_path='')
-CORS(app) # Enable CORS for all routes
-# Secret key is needed for session management in Flask
-app.secret_key = os.environ.get("FLASK_SECRET_KEY", "super-secret-key-for-dev")
+import exporter
+import importer
+import instrumentation
+import job_scheduler
+import ledger
+import snapshot_cache
+import static_assets
+
+# Importing this module only defines routes. create_app() builds the Flask app and checks
+# the schema; the scheduler starts in the background once the server is up, and the Google
+# client libraries load on first use. Serve with e.g. `gunicorn 'app:create_app()'`.
+
+# Give the server time to bind and answer requests before scheduler work competes with it
+SCHEDULER_START_DELAY = float(os.environ.get('GYM_SCHEDULER_START_DELAY', '2'))
+
+routes = Blueprint('gym', __name__)
+
+scheduler = None
+scheduler_leader = None
+_background_lock = threading.Lock()
+
+# --- Request Instrumentation ---
+@routes.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@routes.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        instrumentation.observe_request(request.method, _route_label(), response.status_code, time.perf_counter() - started,
+                                        request.content_length, None if response.is_streamed else response.content_length)
+    return response
+
+@routes.teardown_app_request
+def record_failed_request_metrics(exc):
+    # after_app_request is skipped when an exception escapes the view (e.g. propagated in debug),
+    # so a timer still set here belongs to a request that ended in a 500
+    started = g.pop('request_started', None)
+    if started is not None:
+        instrumentation.observe_request(request.method, _route_label(), 500, time.perf_counter() - started,
+                                        request.content_length, None)
 
 # --- Database Initialization ---
-try:
-    if not os.path.exists(db_utils.DB_PATH):
-        print(f"Database not found at {db_utils.DB_PATH}, initializing...")
-        database_setup.init_db(populate_with_sample_data=True)
-    else:
-        database_setup.init_db(populate_with_sample_data=False)
-    print("Database schema checked/initialized from app.py.")
-except Exception as e:
-    print(f"Failed to initialize database schema: {e}")
+def init_database():
+    # The common case is an up-to-date schema: one PRAGMA read instead of init_db's full check
+    if database_setup.schema_is_current(db_utils.DB_PATH):
+        return
+    try:
+        if not os.path.exists(db_utils.DB_PATH):
+            print(f"Database not found at {db_utils.DB_PATH}, initializing...")
+            database_setup.init_db(populate_with_sample_data=True)
+        else:
+            database_setup.init_db(populate_with_sample_data=False)
+        print("Database schema checked/initialized from app.py.")
+    except Exception as e:
+        print(f"Failed to initialize database schema: {e}")
 
 
 # --- Scheduler Setup ---
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from apscheduler.schedulers.background import BackgroundScheduler
-
-# Define the persistent job store using our existing SQLite database
-jobstores = {
-    'default': SQLAlchemyJobStore(url=f'sqlite:///{db_utils.DB_PATH}')
-}
-
-# Configure executors (how jobs are run)
-executors = {
-    'default': {'type': 'threadpool', 'max_workers': 20}
-}
+def start_background_services():
+    """Starts the job scheduler once per process and returns it; safe to call from any thread."""
+    global scheduler, scheduler_leader
+    with _background_lock:
+        if scheduler is not None:
+            return scheduler
+        started = time.perf_counter()
+        try:
+            db_utils.roll_forward_balances()
+        except Exception as e:
+            print(f"Failed to roll member balances forward: {e}")
+
+        # Jobs persist in their own database (see job_scheduler), never in gym_data.sqlite
+        # Every worker process starts its scheduler paused; only the lease holder resumes it,
+        # so scheduled jobs run once however many workers serve the API
+        new_scheduler = job_scheduler.create_scheduler()
+        new_scheduler.start(paused=True)
+        job_scheduler.migrate_legacy_jobs(new_scheduler)
+        backup_jobs.upgrade_scheduled_backup(new_scheduler)
+        leader = job_scheduler.SchedulerLeader(new_scheduler, on_elected=lambda: backup_jobs.fail_interrupted_jobs(new_scheduler))
+        leader.start()
+
+        # Keep member_balances correct across cycle boundaries even on days without writes
+        new_scheduler.add_job(
+            func=db_utils.roll_forward_balances,
+            trigger='cron',
+            hour=0,
+            minute=5,
+            id='daily-balance-rollforward',
+            replace_existing=True
+        )
+        scheduler, scheduler_leader = new_scheduler, leader
+        seconds = time.perf_counter() - started
+        instrumentation.observe_startup('scheduler', seconds)
+        print(f"Scheduler started in {seconds * 1000:.0f} ms.")
+        return scheduler
 
-# Create the scheduler with the persistent job store
-scheduler = BackgroundScheduler(jobstores=jobstores, executors=executors, daemon=True)
-scheduler.start()
+def _start_background_services_quietly():
+    try:
+        start_background_services()
+    except Exception as e:
+        print(f"Failed to start the scheduler: {e}")
 
 
 # --- Google Drive Backup API Routes ---
-@app.route('/api/backup/authorize')
+@routes.route('/api/backup/authorize')
 def authorize():
     if not os.path.exists(gdrive_service.CREDENTIALS_FILE):
          return jsonify({"error": "credentials.json not found on server."}), 500
 
+    from google_auth_oauthlib.flow import Flow
     flow = Flow.from_client_secrets_file(
         gdrive_service.CREDENTIALS_FILE,
         scopes=gdrive_service.SCOPES,
-        redirect_uri=url_for('oauth2callback', _external=True)
+        redirect_uri=url_for('gym.oauth2callback', _external=True)
     )
     authorization_url, state = flow.authorization_url(
         access_type='offline',
@@ -66,14 +140,15 @@ def authorize():
     session['state'] = state
     return redirect(authorization_url)
 
-@app.route('/oauth2callback')
+@routes.route('/oauth2callback')
 def oauth2callback():
+    from google_auth_oauthlib.flow import Flow
     state = session['state']
     flow = Flow.from_client_secrets_file(
         gdrive_service.CREDENTIALS_FILE,
         scopes=gdrive_service.SCOPES,
         state=state,
-        redirect_uri=url_for('oauth2callback', _external=True)
+        redirect_uri=url_for('gym.oauth2callback', _external=True)
     )
     flow.fetch_token(authorization_response=request.url)
     credentials = flow.credentials
@@ -81,26 +156,35 @@ def oauth2callback():
     with open(gdrive_service.TOKEN_PICKLE_FILE, 'wb') as token_file:
         import pickle
         pickle.dump(credentials, token_file)
+    # The new token may belong to another account: drop the cached client and folder ids
+    gdrive_service.reset_drive_cache()
     
     # Redirect back to the main app page, ideally to the backup tab
     return redirect('/#backup')
 
-@app.route('/api/backup/status', methods=['GET'])
+@routes.route('/api/backup/status', methods=['GET'])
 def backup_status():
     is_authorized = os.path.exists(gdrive_service.TOKEN_PICKLE_FILE)
-    return jsonify({"isAuthorized": is_authorized})
+    return jsonify({"isAuthorized": is_authorized, "lastBackup": backup_jobs.get_last_backup()})
 
-@app.route('/api/backup/now', methods=['POST'])
+@routes.route('/api/backup/now', methods=['POST'])
 def backup_now():
-    result = gdrive_service.upload_db_to_drive()
-    if result.get("success"):
-        return jsonify(result)
-    else:
-        return jsonify(result), 500
-
-@app.route('/api/backup/schedule/get', methods=['GET'])
+    mode = 'incremental' if request.args.get('mode') == 'incremental' else 'full'
+    job, created = backup_jobs.submit_backup(start_background_services(), mode)
+    if not created:
+        return jsonify({"error": "A backup is already running.", "job": job}), 409
+    return jsonify({"jobId": job['id'], "job": job}), 202
+
+@routes.route('/api/backup/jobs/<job_id>', methods=['GET'])
+def backup_job_status(job_id):
+    job = backup_jobs.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Backup job not found"}), 404
+    return jsonify(job)
+
+@routes.route('/api/backup/schedule/get', methods=['GET'])
 def get_schedule():
-    job = scheduler.get_job('daily-db-backup')
+    job = start_background_services().get_job(backup_jobs.SCHEDULED_JOB_ID)
     if job:
         # The trigger object has the run time info
         # job.trigger.fields is a list of field objects from the cron trigger
@@ -120,7 +204,7 @@ def get_schedule():
     else:
         return jsonify({"isScheduled": False})
 
-@app.route('/api/backup/schedule/set', methods=['POST'])
+@routes.route('/api/backup/schedule/set', methods=['POST'])
 def set_schedule():
     data = request.json
     backup_time = data.get('time') # Expected format "HH:MM"
@@ -129,16 +213,18 @@ def set_schedule():
     
     try:
         hour, minute = map(int, backup_time.split(':'))
+        scheduler = start_background_services()
         # Remove existing job before adding a new one
-        if scheduler.get_job('daily-db-backup'):
-            scheduler.remove_job('daily-db-backup')
+        if scheduler.get_job(backup_jobs.SCHEDULED_JOB_ID):
+            scheduler.remove_job(backup_jobs.SCHEDULED_JOB_ID)
 
+        # Scheduled runs go through backup_jobs too, so they and manual backups never overlap
         scheduler.add_job(
-            func=gdrive_service.upload_db_to_drive,
+            func=backup_jobs.run_scheduled_backup,
             trigger='cron',
             hour=hour,
             minute=minute,
-            id='daily-db-backup',
+            id=backup_jobs.SCHEDULED_JOB_ID,
             replace_existing=True
         )
         print(f"Backup job scheduled for {hour:02d}:{minute:02d} daily.")
@@ -147,27 +233,159 @@ def set_schedule():
         print(f"Error setting schedule: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/backup/schedule/cancel', methods=['POST'])
+@routes.route('/api/backup/schedule/cancel', methods=['POST'])
 def cancel_schedule():
-    if scheduler.get_job('daily-db-backup'):
-        scheduler.remove_job('daily-db-backup')
+    scheduler = start_background_services()
+    if scheduler.get_job(backup_jobs.SCHEDULED_JOB_ID):
+        scheduler.remove_job(backup_jobs.SCHEDULED_JOB_ID)
         print("Backup job cancelled.")
         return jsonify({"success": True, "message": "Backup schedule cancelled."})
     return jsonify({"success": False, "message": "No schedule was set."})
 
 
 # --- Core App API Routes (Unchanged) ---
-@app.route('/api/all-data', methods=['GET'])
+def _snapshot_response(snapshot):
+    # Serves a cached JSON body (plain or gzipped) with revalidation against its ETag
+    use_gzip = 'gzip' in request.accept_encodings
+    etag = snapshot['etag'] + ('-gzip' if use_gzip else '')
+    if snapshot['etag'] in request.if_none_match or f"{snapshot['etag']}-gzip" in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(snapshot['gzipBody'] if use_gzip else snapshot['body'], mimetype='application/json')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@routes.route('/api/all-data', methods=['GET'])
 def get_all_data_route():
     try:
-        data = db_utils.get_all_data()
-        return jsonify(data)
+        return _snapshot_response(snapshot_cache.get_snapshot())
     except Exception as e:
         print(f"Error fetching all data: {e}")
         return jsonify({"error": "Failed to fetch data"}), 500
 
+@routes.route('/api/metrics', methods=['GET'])
+def prometheus_metrics_route():
+    body = instrumentation.render_metrics(db_utils.get_pool_stats())
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@routes.route('/api/metrics/summary', methods=['GET'])
+def get_metrics_summary_route():
+    try:
+        summary = db_utils.get_metrics_summary(request.args.get('gender'))
+        return jsonify(summary)
+    except Exception as e:
+        print(f"Error fetching metrics summary: {e}")
+        return jsonify({"error": "Failed to fetch metrics summary"}), 500
+
+@routes.route('/api/metrics/revenue', methods=['GET'])
+def get_revenue_route():
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in ('month', 'week', 'day'):
+        return jsonify({"error": "granularity must be month, week or day"}), 400
+    try:
+        year = int(request.args['year']) if request.args.get('year') else None
+        return jsonify(db_utils.get_revenue(year, granularity, request.args.get('gender')))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        print(f"Error fetching revenue: {e}")
+        return jsonify({"error": "Failed to fetch revenue"}), 500
+
+@routes.route('/api/changes', methods=['GET'])
+def get_changes_route():
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"error": "since must be an integer version"}), 400
+    try:
+        return jsonify(db_utils.get_changes(since))
+    except Exception as e:
+        print(f"Error fetching changes since {since}: {e}")
+        return jsonify({"error": "Failed to fetch changes"}), 500
+
+@routes.route('/api/all-data/stream', methods=['GET'])
+def stream_all_data_route():
+    # Members arrive in id order (not name order) so histories can be merged in one pass
+    return Response(db_utils.iter_all_data_ndjson(), mimetype='application/x-ndjson')
+
+@routes.route('/api/db/pool-stats', methods=['GET'])
+def get_pool_stats_route():
+    return jsonify(db_utils.get_pool_stats())
+
+@routes.route('/api/batch', methods=['POST'])
+def batch_route():
+    data = request.json
+    operations = data.get('operations') if isinstance(data, dict) else data
+    if not isinstance(operations, list):
+        return jsonify({"error": "Expected a list of operations"}), 400
+    try:
+        results = db_utils.run_batch(operations)
+        return jsonify({"success": True, "results": results})
+    except db_utils.BatchOperationError as be:
+        return jsonify({"error": str(be), "index": be.index}), 400
+    except Exception as e:
+        print(f"Error running batch of {len(operations)} operation(s): {e}")
+        return jsonify({"error": f"Failed to run batch: {str(e)}"}), 500
+
+@routes.route('/api/import', methods=['POST'])
+def import_route():
+    data_format = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    record_type = request.args.get('type')
+    if data_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    if data_format == 'csv' and record_type not in importer.RECORD_TYPES:
+        return jsonify({"error": "CSV imports need type=members, payments or writeoffs"}), 400
+    try:
+        report = importer.import_rows(request.stream, data_format, record_type,
+                                      defer_indexes=request.args.get('deferIndexes') == '1')
+        return jsonify(report)
+    except Exception as e:
+        print(f"Error importing data: {e}")
+        return jsonify({"error": f"Failed to import data: {str(e)}"}), 500
+
+@routes.route('/api/export/<kind>', methods=['GET'])
+def export_route(kind):
+    if kind not in exporter.EXPORT_COLUMNS:
+        return jsonify({"error": "Export must be payments, writeoffs or ledger"}), 404
+    data_format = request.args.get('format', 'csv')
+    if data_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    date_from, date_to = request.args.get('from'), request.args.get('to')
+    for value in (date_from, date_to):
+        if value and not ledger.parse_date(value):
+            return jsonify({"error": "from/to must be dates in YYYY-MM-DD format"}), 400
+    compress = request.args.get('gzip') == '1'
+
+    chunks = exporter.iter_export(kind, data_format, date_from, date_to, request.args.get('memberId'), compress)
+    file_name = f"{kind}.{data_format}" + ('.gz' if compress else '')
+    response = Response(chunks, mimetype='text/csv' if data_format == 'csv' else 'application/x-ndjson')
+    if compress:
+        response.mimetype = 'application/gzip'
+    response.headers['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    return response
+
 # ... (all other member, payment, writeoff, history routes remain here, unchanged) ...
-@app.route('/api/members', methods=['POST'])
+@routes.route('/api/members', methods=['GET'])
+def list_members_route():
+    try:
+        page_size = min(max(int(request.args.get('page_size', 50)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "page_size must be an integer"}), 400
+    try:
+        page = db_utils.list_members(page_size, request.args.get('cursor'), request.args.get('sort', 'name'),
+                                     request.args.get('direction'), request.args.get('gender'), request.args.get('status'))
+        return jsonify(page)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error listing members: {e}")
+        return jsonify({"error": "Failed to list members"}), 500
+
+@routes.route('/api/members', methods=['POST'])
 def add_member_route():
     try:
         member_data = request.json
@@ -186,7 +404,30 @@ def add_member_route():
         print(f"Error adding member: {e}")
         return jsonify({"error": f"Failed to add member: {str(e)}"}), 500
 
-@app.route('/api/members/<member_id>', methods=['PUT'])
+@routes.route('/api/members/search', methods=['GET'])
+def search_members_route():
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    try:
+        return jsonify(db_utils.search_members(request.args.get('q', ''), limit))
+    except Exception as e:
+        print(f"Error searching members: {e}")
+        return jsonify({"error": "Failed to search members"}), 500
+
+@routes.route('/api/members/as-of', methods=['GET'])
+def members_as_of_route():
+    as_of = ledger.parse_date(request.args.get('date', '')) if request.args.get('date') else date.today()
+    if not as_of:
+        return jsonify({"error": "date must be a date in YYYY-MM-DD format"}), 400
+    try:
+        return _snapshot_response(snapshot_cache.get_members_as_of(as_of.isoformat()))
+    except Exception as e:
+        print(f"Error fetching members as of {as_of}: {e}")
+        return jsonify({"error": "Failed to fetch members"}), 500
+
+@routes.route('/api/members/<member_id>', methods=['PUT'])
 def update_member_route(member_id):
     try:
         member_data = request.json
@@ -207,7 +448,7 @@ def update_member_route(member_id):
         print(f"Error updating member {member_id}: {e}")
         return jsonify({"error": f"Failed to update member: {str(e)}"}), 500
 
-@app.route('/api/members/<member_id>', methods=['DELETE'])
+@routes.route('/api/members/<member_id>', methods=['DELETE'])
 def delete_member_route(member_id):
     try:
         success = db_utils.delete_member(member_id)
@@ -219,8 +460,26 @@ def delete_member_route(member_id):
         print(f"Error deleting member {member_id}: {e}")
         return jsonify({"error": "Failed to delete member"}), 500
 
+@routes.route('/api/members/<member_id>/ledger', methods=['GET'])
+def get_member_ledger_route(member_id):
+    until = None
+    until_str = request.args.get('until')
+    if until_str:
+        until = ledger.parse_date(until_str)
+        if not until:
+            return jsonify({"error": "until must be a date in YYYY-MM-DD format"}), 400
+    try:
+        member_ledger = db_utils.get_member_ledger(member_id, until)
+        if member_ledger:
+            return jsonify(member_ledger)
+        else:
+            return jsonify({"error": "Member not found"}), 404
+    except Exception as e:
+        print(f"Error building ledger for member {member_id}: {e}")
+        return jsonify({"error": "Failed to build ledger"}), 500
+
 # --- Payments ---
-@app.route('/api/payments', methods=['POST'])
+@routes.route('/api/payments', methods=['POST'])
 def add_payment_route():
     try:
         payment_data = request.json
@@ -232,7 +491,7 @@ def add_payment_route():
         print(f"Error adding payment: {e}")
         return jsonify({"error": "Failed to add payment"}), 500
 
-@app.route('/api/payments/<payment_id>', methods=['PUT'])
+@routes.route('/api/payments/<payment_id>', methods=['PUT'])
 def update_payment_route(payment_id):
     try:
         payment_data = request.json
@@ -246,7 +505,7 @@ def update_payment_route(payment_id):
         print(f"Error updating payment {payment_id}: {e}")
         return jsonify({"error": "Failed to update payment"}), 500
 
-@app.route('/api/payments/<payment_id>', methods=['DELETE'])
+@routes.route('/api/payments/<payment_id>', methods=['DELETE'])
 def delete_payment_route(payment_id):
     try:
         success = db_utils.delete_payment(payment_id)
@@ -259,7 +518,7 @@ def delete_payment_route(payment_id):
         return jsonify({"error": "Failed to delete payment"}), 500
 
 # --- WriteOffs ---
-@app.route('/api/writeoffs', methods=['POST'])
+@routes.route('/api/writeoffs', methods=['POST'])
 def add_writeoff_route():
     try:
         writeoff_data = request.json
@@ -271,7 +530,7 @@ def add_writeoff_route():
         print(f"Error adding write-off: {e}")
         return jsonify({"error": "Failed to add write-off"}), 500
 
-@app.route('/api/writeoffs/<writeoff_id>', methods=['PUT'])
+@routes.route('/api/writeoffs/<writeoff_id>', methods=['PUT'])
 def update_writeoff_route(writeoff_id):
     try:
         writeoff_data = request.json
@@ -285,7 +544,7 @@ def update_writeoff_route(writeoff_id):
         print(f"Error updating write-off {writeoff_id}: {e}")
         return jsonify({"error": "Failed to update write-off"}), 500
 
-@app.route('/api/writeoffs/<writeoff_id>', methods=['DELETE'])
+@routes.route('/api/writeoffs/<writeoff_id>', methods=['DELETE'])
 def delete_writeoff_route(writeoff_id):
     try:
         success = db_utils.delete_writeoff(writeoff_id)
@@ -298,7 +557,7 @@ def delete_writeoff_route(writeoff_id):
         return jsonify({"error": "Failed to delete write-off"}), 500
 
 # --- Member History Entry Edits/Deletes ---
-@app.route('/api/members/<member_id>/history/<history_type>/<entry_id>', methods=['PUT'])
+@routes.route('/api/members/<member_id>/history/<history_type>/<entry_id>', methods=['PUT'])
 def update_member_history_route(member_id, history_type, entry_id):
     try:
         data = request.json
@@ -317,7 +576,7 @@ def update_member_history_route(member_id, history_type, entry_id):
         print(f"Error updating history entry ({history_type}) for member {member_id}: {e}")
         return jsonify({"error": f"Failed to update history entry: {str(e)}"}), 500
 
-@app.route('/api/members/<member_id>/history/<history_type>/<entry_id>', methods=['DELETE'])
+@routes.route('/api/members/<member_id>/history/<history_type>/<entry_id>', methods=['DELETE'])
 def delete_member_history_route(member_id, history_type, entry_id):
     try:
         updated_member = db_utils.delete_specific_history_entry(member_id, entry_id, history_type)
@@ -333,23 +592,84 @@ def delete_member_history_route(member_id, history_type, entry_id):
 
 
 # --- Serve SPA ---
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
+@routes.route('/', defaults={'path': ''})
+@routes.route('/<path:path>')
 def serve_spa(path):
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
+    # Unknown paths get index.html so client-side routes survive a reload
+    asset = static_assets.lookup(path) if path else None
+    asset = asset or static_assets.lookup('index.html')
+    if asset is None:
+        return jsonify({"error": "Not found"}), 404
+
+    encoding, body = static_assets.select_encoding(asset, request.accept_encodings)
+    # Strong ETags: each encoding is a different byte sequence, so it gets its own tag
+    etag = asset['etag'] + (f'-{encoding}' if encoding else '')
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
     else:
-        return send_from_directory(app.static_folder, 'index.html')
+        response = current_app.response_class(body, mimetype=asset['mimetype'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = (static_assets.IMMUTABLE_CACHE_CONTROL if asset['immutable']
+                                         else static_assets.REVALIDATE_CACHE_CONTROL)
+    if asset['compressible']:
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 def shutdown_app():
+    global scheduler, scheduler_leader
     print("Application shutting down...")
     db_utils.create_checkpoint()
     print("Final database checkpoint successful.")
-    scheduler.shutdown()
-    print("Scheduler shut down.")
-
-atexit.register(shutdown_app)
+    db_utils.close_connections()
+    with _background_lock:
+        if scheduler is not None:
+            scheduler_leader.stop()
+            scheduler.shutdown()
+            scheduler = scheduler_leader = None
+            print("Scheduler shut down.")
+
+def create_app(start_scheduler=True):
+    """Builds the Flask app. Pass start_scheduler=False (e.g. in tests) to leave the scheduler off until a route needs it."""
+    started = time.perf_counter()
+    # public/ is served by serve_spa from static_assets' in-memory table, not Flask's static route
+    app = Flask(__name__, static_folder=None)
+    CORS(app) # Enable CORS for all routes
+    # Secret key is needed for session management in Flask
+    app.secret_key = os.environ.get("FLASK_SECRET_KEY", "super-secret-key-for-dev")
+    app.register_blueprint(routes)
+
+    init_database()
+    static_assets.load_routes()
+    atexit.unregister(shutdown_app) # register once however many apps are created
+    atexit.register(shutdown_app)
+    if start_scheduler:
+        timer = threading.Timer(SCHEDULER_START_DELAY, _start_background_services_quietly)
+        timer.daemon = True
+        timer.start()
+
+    seconds = time.perf_counter() - started
+    instrumentation.observe_startup('create_app', seconds)
+    print(f"App created in {seconds * 1000:.0f} ms (module import took {IMPORT_SECONDS * 1000:.0f} ms).")
+    return app
+
+_app = None
+_app_lock = threading.Lock()
+
+def __getattr__(name):
+    # Keeps `app:app` (gunicorn, flask run) working: the app is created on first access, not on import
+    global _app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+    return _app
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+instrumentation.observe_startup('import', IMPORT_SECONDS)
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    app.run(debug=True, port=port, use_reloader=False) # use_reloader=False is important for APScheduler
\ No newline at end of file
+    create_app().run(debug=True, port=port, use_reloader=False) # use_reloader=False is important for APScheduler
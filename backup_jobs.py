@@ -0,0 +1,204 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import database_utils as db_utils
+import gdrive_service
+import job_scheduler
+
+# Manual backups run as one-off jobs in the shared scheduler store, so whichever worker
+# holds the scheduler lease runs them (never two at once, scheduled or manual). Job state
+# lives in the scheduler database so that any worker can answer /api/backup/jobs/<id>.
+
+MAX_FINISHED_JOBS = 20
+ACTIVE_STATUSES = ('queued', 'running')
+SCHEDULED_JOB_ID = 'daily-db-backup'
+# A queued job normally starts within seconds; one still queued after this long was orphaned
+# (e.g. its worker died between recording it and adding it to the scheduler)
+QUEUED_TIMEOUT_SECONDS = 3600
+ORPHAN_GRACE_SECONDS = 60 # time submit_backup has to add the job after recording it
+
+_table_ready = False
+
+
+def _connection():
+    global _table_ready
+    if not _table_ready:
+        with job_scheduler.coordination_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS backup_jobs (
+                    id TEXT PRIMARY KEY,
+                    mode TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    bytesUploaded INTEGER NOT NULL DEFAULT 0,
+                    totalBytes INTEGER,
+                    progress REAL NOT NULL DEFAULT 0,
+                    queuedAt TEXT NOT NULL,
+                    startedAt TEXT,
+                    finishedAt TEXT,
+                    seconds REAL,
+                    message TEXT,
+                    stats TEXT
+                )
+            """)
+        _table_ready = True
+    return job_scheduler.coordination_connection()
+
+
+def _job_dict(row):
+    job = dict(row)
+    job['stats'] = json.loads(job['stats']) if job['stats'] else None
+    return job
+
+
+def _update(job_id, **fields):
+    if 'stats' in fields:
+        fields['stats'] = json.dumps(fields['stats']) if fields['stats'] is not None else None
+    assignments = ', '.join(f"{field} = :{field}" for field in fields)
+    with _connection() as conn:
+        conn.execute(f"UPDATE backup_jobs SET {assignments} WHERE id = :id", dict(fields, id=job_id))
+
+
+def get_job(job_id):
+    with _connection() as conn:
+        row = conn.execute("SELECT * FROM backup_jobs WHERE id = ?", (job_id,)).fetchone()
+    return _job_dict(row) if row else None
+
+
+def get_active_job():
+    with _connection() as conn:
+        row = conn.execute("SELECT * FROM backup_jobs WHERE status IN (?, ?) ORDER BY queuedAt LIMIT 1",
+                           ACTIVE_STATUSES).fetchone()
+    return _job_dict(row) if row else None
+
+
+def get_last_backup():
+    """Stats of the most recent successful backup run by any worker, or None."""
+    with _connection() as conn:
+        row = conn.execute("SELECT * FROM backup_jobs WHERE status = 'succeeded' ORDER BY finishedAt DESC LIMIT 1").fetchone()
+    if not row:
+        return None
+    job = _job_dict(row)
+    return dict(job['stats'] or {}, mode=job['mode'], jobId=job['id'], finishedAt=job['finishedAt'])
+
+
+def _create_job(mode):
+    """Records a queued backup; returns (job, created). An active job is returned instead of a second one."""
+    job_id = db_utils.generate_id()
+    with _connection() as conn:
+        # IMMEDIATE: the check and the insert must not interleave with another worker's
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                UPDATE backup_jobs SET status = 'failed', stage = 'done', finishedAt = ?,
+                    message = 'Interrupted: the backup was queued but never started.'
+                WHERE status = 'queued' AND queuedAt < ?
+            """, (datetime.now().isoformat(), (datetime.now() - timedelta(seconds=QUEUED_TIMEOUT_SECONDS)).isoformat()))
+            active = conn.execute("SELECT * FROM backup_jobs WHERE status IN (?, ?) ORDER BY queuedAt LIMIT 1",
+                                  ACTIVE_STATUSES).fetchone()
+            if active:
+                conn.execute("COMMIT")
+                return _job_dict(active), False
+            conn.execute("""
+                INSERT INTO backup_jobs (id, mode, status, queuedAt) VALUES (?, ?, 'queued', ?)
+            """, (job_id, mode, datetime.now().isoformat()))
+            # The last successful backup is kept however many failures followed it (see get_last_backup)
+            conn.execute("""
+                DELETE FROM backup_jobs WHERE status NOT IN (?, ?) AND id NOT IN (
+                    SELECT id FROM backup_jobs WHERE status NOT IN (?, ?) ORDER BY queuedAt DESC LIMIT ?)
+                AND id IS NOT (SELECT id FROM backup_jobs WHERE status = 'succeeded' ORDER BY finishedAt DESC LIMIT 1)
+            """, ACTIVE_STATUSES + ACTIVE_STATUSES + (MAX_FINISHED_JOBS,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return get_job(job_id), True
+
+
+def submit_backup(scheduler, mode='full'):
+    """Queues a backup; returns (job, created). An active job is returned instead of a second one."""
+    job, created = _create_job(mode)
+    if not created:
+        return job, False
+    job_id = job['id']
+    try:
+        # No trigger: run as soon as the leader picks it up, however late that is
+        scheduler.add_job(run_backup_job, args=[job_id, mode], id=f'backup-job-{job_id}',
+                          misfire_grace_time=None)
+    except Exception as e:
+        _update(job_id, status='failed', stage='done', finishedAt=datetime.now().isoformat(), message=str(e))
+        raise
+    return get_job(job_id), True
+
+
+def run_scheduled_backup(mode='full'):
+    """Entry point of the daily schedule: recorded like a manual backup, and skipped while one is active."""
+    job, created = _create_job(mode)
+    if not created:
+        print(f"Scheduled backup skipped: backup job {job['id']} is still {job['status']}.")
+        return
+    run_backup_job(job['id'], mode)
+
+
+def upgrade_scheduled_backup(scheduler):
+    """Points a daily schedule saved before backups were tracked as jobs at run_scheduled_backup."""
+    job = scheduler.get_job(SCHEDULED_JOB_ID)
+    if job and job.func is not run_scheduled_backup:
+        scheduler.modify_job(SCHEDULED_JOB_ID, func=run_scheduled_backup, args=(), kwargs={})
+        print("Daily backup schedule now runs as a tracked backup job.")
+
+
+def fail_interrupted_jobs(scheduler=None):
+    """Marks jobs left 'running' by a previous scheduler leader, or queued with no scheduler job, as failed."""
+    with _connection() as conn:
+        cursor = conn.execute("""
+            UPDATE backup_jobs SET status = 'failed', stage = 'done', finishedAt = ?,
+                message = 'Interrupted: the process running this backup stopped.'
+            WHERE status = 'running'
+        """, (datetime.now().isoformat(),))
+        failed = cursor.rowcount
+        if scheduler is not None:
+            queued = conn.execute("SELECT id FROM backup_jobs WHERE status = 'queued' AND queuedAt < ?",
+                                  ((datetime.now() - timedelta(seconds=ORPHAN_GRACE_SECONDS)).isoformat(),)).fetchall()
+            for row in queued:
+                if scheduler.get_job(f"backup-job-{row['id']}") is None:
+                    failed += conn.execute("""
+                        UPDATE backup_jobs SET status = 'failed', stage = 'done', finishedAt = ?,
+                            message = 'Interrupted: the backup was queued but never scheduled.'
+                        WHERE id = ? AND status = 'queued'
+                    """, (datetime.now().isoformat(), row['id'])).rowcount
+    if failed:
+        print(f"Marked {failed} interrupted backup job(s) as failed.")
+
+
+def run_backup_job(job_id, mode='full'):
+    started = time.perf_counter()
+    _update(job_id, status='running', startedAt=datetime.now().isoformat())
+    progress = {'value': 0}
+
+    def report_progress(stage, bytes_uploaded=None, total_bytes=None):
+        fields = {'stage': stage}
+        if bytes_uploaded is not None:
+            fields['bytesUploaded'] = bytes_uploaded
+        if total_bytes:
+            fields['totalBytes'] = total_bytes
+            fields['progress'] = progress['value'] = round(100 * (bytes_uploaded or 0) / total_bytes, 1)
+        _update(job_id, **fields)
+
+    try:
+        if mode == 'incremental':
+            result = gdrive_service.incremental_backup_to_drive(progress_callback=report_progress)
+        else:
+            result = gdrive_service.upload_db_to_drive(progress_callback=report_progress)
+    except Exception as e:
+        result = {"success": False, "message": str(e)}
+
+    _update(job_id,
+            status='succeeded' if result.get('success') else 'failed',
+            stage='done',
+            progress=100 if result.get('success') else progress['value'],
+            finishedAt=datetime.now().isoformat(),
+            seconds=round(time.perf_counter() - started, 3),
+            message=result.get('message'),
+            stats=result.get('stats'))
@@ -0,0 +1,194 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+import database_utils as db_utils
+
+# Incremental, content-addressed backups. A snapshot is split into fixed-size chunks of
+# whole database pages; each chunk is stored once under its SHA-256, and every backup
+# writes a small manifest listing its chunks in order. Only chunks the store does not
+# already have are uploaded, and any manifest can be reassembled into a database.
+
+PAGES_PER_CHUNK = 64
+MANIFEST_PREFIX = 'manifest-'
+CHUNK_PREFIX = 'chunk-'
+# Manifests are named after the backup time; microseconds keep two backups in the same
+# second apart. Names written before that have whole seconds and are still read.
+MANIFEST_TIME_FORMAT = '%Y-%m-%d_%H-%M-%S.%f'
+LEGACY_MANIFEST_TIME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+
+class LocalDirectoryBackend:
+    """Stores chunks and manifests as files in one directory (offline/testing store)."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def has(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        temp_path = self._path(key) + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self._path(key))
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def list(self, prefix=''):
+        return sorted(name for name in os.listdir(self.root) if name.startswith(prefix) and not name.endswith('.tmp'))
+
+
+def _page_size(path):
+    with open(path, 'rb') as f:
+        header = f.read(100)
+    page_size = int.from_bytes(header[16:18], 'big')
+    return 65536 if page_size == 1 else page_size
+
+
+def _manifest_time(name):
+    stamp = name[len(MANIFEST_PREFIX):-len('.json')]
+    for time_format in (MANIFEST_TIME_FORMAT, LEGACY_MANIFEST_TIME_FORMAT):
+        try:
+            return datetime.strptime(stamp, time_format)
+        except ValueError:
+            pass
+    return None
+
+
+def create_incremental_backup(backend, label=None, progress_callback=None):
+    started = time.perf_counter()
+    created_at = datetime.now()
+    manifest_name = f"{MANIFEST_PREFIX}{created_at.strftime(MANIFEST_TIME_FORMAT)}.json"
+    if backend.has(manifest_name):
+        # Never replace an existing backup's manifest; its chunks may differ from this snapshot's
+        raise FileExistsError(f"Backup manifest {manifest_name} already exists.")
+    with tempfile.TemporaryDirectory(prefix='gym_backup_') as temp_dir:
+        snapshot_path = os.path.join(temp_dir, 'snapshot.sqlite')
+        size = db_utils.create_backup_snapshot(snapshot_path)
+        page_size = _page_size(snapshot_path)
+        chunk_size = page_size * PAGES_PER_CHUNK
+
+        chunks = []
+        stats = {'chunks': 0, 'chunksUploaded': 0, 'bytesUploaded': 0, 'snapshotBytes': size}
+        file_hash = hashlib.sha256()
+        with open(snapshot_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                file_hash.update(chunk)
+                digest = hashlib.sha256(chunk).hexdigest()
+                chunks.append(digest)
+                stats['chunks'] += 1
+                key = CHUNK_PREFIX + digest
+                if not backend.has(key):
+                    compressed = zlib.compress(chunk, 6)
+                    backend.put(key, compressed)
+                    stats['chunksUploaded'] += 1
+                    stats['bytesUploaded'] += len(compressed)
+                if progress_callback:
+                    progress_callback(f.tell(), size)
+
+    manifest = {
+        'formatVersion': 1,
+        'createdAt': created_at.isoformat(),
+        'label': label,
+        'size': size,
+        'pageSize': page_size,
+        'chunkSize': chunk_size,
+        'sha256': file_hash.hexdigest(),
+        'chunks': chunks,
+    }
+    manifest_bytes = json.dumps(manifest).encode('utf-8')
+    backend.put(manifest_name, manifest_bytes)
+    stats['bytesUploaded'] += len(manifest_bytes)
+    stats['manifest'] = manifest_name
+    stats['totalSeconds'] = round(time.perf_counter() - started, 3)
+    print(f"Incremental backup {manifest_name}: {stats['chunksUploaded']}/{stats['chunks']} new chunk(s), "
+          f"{stats['bytesUploaded']} bytes uploaded.")
+    return stats
+
+
+def list_manifests(backend):
+    return backend.list(MANIFEST_PREFIX)
+
+
+def find_manifest(backend, at=None):
+    """Latest manifest, or the latest one taken at or before `at` (a datetime)."""
+    # Compared by parsed time: whole-second and microsecond names do not sort together as strings
+    timed = []
+    for name in list_manifests(backend):
+        created = _manifest_time(name)
+        if created is not None and (at is None or created <= at):
+            timed.append((created, name))
+    return max(timed)[1] if timed else None
+
+
+def restore_backup(backend, manifest_name, dest_path):
+    manifest = json.loads(backend.get(manifest_name))
+    file_hash = hashlib.sha256()
+    temp_path = dest_path + '.restoring'
+    try:
+        with open(temp_path, 'wb') as f:
+            for digest in manifest['chunks']:
+                chunk = zlib.decompress(backend.get(CHUNK_PREFIX + digest))
+                if hashlib.sha256(chunk).hexdigest() != digest:
+                    raise ValueError(f"Chunk {digest} is corrupt")
+                file_hash.update(chunk)
+                f.write(chunk)
+        if file_hash.hexdigest() != manifest['sha256'] or os.path.getsize(temp_path) != manifest['size']:
+            raise ValueError(f"Restored database does not match manifest {manifest_name}")
+    except BaseException:
+        # Never leave a partial database behind, whatever stopped the restore
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, dest_path)
+    print(f"Restored {manifest_name} to {dest_path} ({manifest['size']} bytes).")
+    return manifest
+
+
+def _backend_from_args(args):
+    if args.drive:
+        import gdrive_service
+        return gdrive_service.get_incremental_backend()
+    return LocalDirectoryBackend(args.store)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental database backups.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--store', help='Local backup directory')
+    source.add_argument('--drive', action='store_true', help='Use the Google Drive incremental folder')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('backup', help='Take an incremental backup of the live database')
+    commands.add_parser('list', help='List backup manifests')
+    restore_parser = commands.add_parser('restore', help='Rebuild a database from a manifest')
+    restore_parser.add_argument('dest', help='Path of the database file to write')
+    restore_parser.add_argument('--manifest', help='Manifest name (defaults to the latest)')
+    restore_parser.add_argument('--at', help='Restore the latest backup taken at or before YYYY-MM-DDTHH:MM:SS')
+    args = parser.parse_args()
+
+    backend = _backend_from_args(args)
+    if args.command == 'backup':
+        create_incremental_backup(backend)
+    elif args.command == 'list':
+        for name in list_manifests(backend):
+            print(name)
+    else:
+        manifest_name = args.manifest or find_manifest(backend, datetime.fromisoformat(args.at) if args.at else None)
+        if not manifest_name:
+            parser.exit(1, "No matching backup manifest found.\n")
+        restore_backup(backend, manifest_name, args.dest)
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import database_setup
+import database_utils as db_utils
+import synthetic_data
+
+# Times the main read/write paths against a copy of a (synthetic) dataset and writes the
+# results as JSON, so runs on different commits can be compared with --compare.
+
+DEFAULT_ITERATIONS = {
+    'get_all_data': 3,
+    'get_member_by_id': 200,
+    'upsert_member': 100,
+    'upsert_payment': 200,
+    'update_history_entry': 100,
+    'delete_specific_history_entry': 100,
+    'create_backup_snapshot': 3,
+}
+REGRESSION_THRESHOLD = 0.2 # flag a benchmark whose median got more than 20% slower
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summary(samples):
+    ordered = sorted(samples)
+    return {
+        'iterations': len(ordered),
+        'minMs': round(ordered[0] * 1000, 3),
+        'medianMs': round(statistics.median(ordered) * 1000, 3),
+        'p95Ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        'meanMs': round(statistics.fmean(ordered) * 1000, 3),
+        'maxMs': round(ordered[-1] * 1000, 3),
+    }
+
+
+def _dataset_counts():
+    with db_utils.get_db_connection(readonly=True) as conn:
+        return {table_name: conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+                for table_name in ('members', 'payments', 'writeoffs', 'member_status_history',
+                                   'member_monthly_fee_history', 'member_payment_cycle_day_history')}
+
+
+def _benchmark_cases(rng, member_ids, temp_dir):
+    """(name, run) pairs; each run() call prepares its input untimed and returns the timed function."""
+    today = date.today()
+
+    def get_all_data():
+        return db_utils.get_all_data
+
+    def get_member_by_id():
+        member_id = rng.choice(member_ids)
+        return lambda: db_utils.get_member_by_id(member_id)
+
+    def upsert_member():
+        member = db_utils.get_member_by_id(rng.choice(member_ids))
+        member['mobile'] = f"03{rng.randint(0, 999999999):09d}"
+        return lambda: db_utils.upsert_member(member)
+
+    def upsert_payment():
+        member = db_utils.get_member_by_id(rng.choice(member_ids))
+        period_start = (today - timedelta(days=rng.randint(0, 365))).isoformat()
+        payment = {'id': db_utils.generate_id(), 'memberId': member['id'], 'date': today.isoformat(),
+                   'appliedToPeriodStartDate': period_start, 'paymentType': 'Monthly Fee',
+                   'amount': member['monthlyFeeHistory'][-1]['value']}
+        return lambda: db_utils.upsert_payment(payment)
+
+    def update_history_entry():
+        member = db_utils.get_member_by_id(rng.choice(member_ids))
+        entry = rng.choice(member['monthlyFeeHistory'])
+        new_date = (date.fromisoformat(entry['effectiveDate']) + timedelta(days=rng.choice([-1, 1]))).isoformat()
+        return lambda: db_utils.update_history_entry(member['id'], entry['id'], 'monthlyFeeHistory', new_date)
+
+    def delete_specific_history_entry():
+        # Add a fee change first (untimed) so there is always a second entry to delete
+        member = db_utils.get_member_by_id(rng.choice(member_ids))
+        entry = {'id': db_utils.generate_id(), 'value': member['monthlyFeeHistory'][-1]['value'] + 500,
+                 'effectiveDate': (today - timedelta(days=rng.randint(0, 180))).isoformat()}
+        member['monthlyFeeHistory'].append(entry)
+        db_utils.upsert_member(member)
+        return lambda: db_utils.delete_specific_history_entry(member['id'], entry['id'], 'monthlyFeeHistory')
+
+    def create_backup_snapshot():
+        snapshot_path = os.path.join(temp_dir, 'snapshot.sqlite')
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+        return lambda: db_utils.create_backup_snapshot(snapshot_path)
+
+    return [('get_all_data', get_all_data), ('get_member_by_id', get_member_by_id),
+            ('upsert_member', upsert_member), ('upsert_payment', upsert_payment),
+            ('update_history_entry', update_history_entry),
+            ('delete_specific_history_entry', delete_specific_history_entry),
+            ('create_backup_snapshot', create_backup_snapshot)]
+
+
+def run_benchmarks(db_path, iterations=None, only=None, seed=42):
+    """Runs every benchmark against a private copy of db_path; returns the results document."""
+    rng = random.Random(seed)
+    results = {
+        'commit': _git_commit(),
+        'createdAt': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'database': os.path.abspath(db_path),
+        'seed': seed,
+        'benchmarks': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='gym_bench_') as temp_dir:
+        # Writes go to a copy so the dataset stays identical between runs
+        work_path = os.path.join(temp_dir, 'bench.sqlite')
+        src, dst = sqlite3.connect(db_path), sqlite3.connect(work_path)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        database_setup.DB_PATH = db_utils.DB_PATH = work_path
+        database_setup.init_db(populate_with_sample_data=False)
+        db_utils.close_connections()
+        try:
+            db_utils.roll_forward_balances()
+            results['dataset'] = _dataset_counts()
+            with db_utils.get_db_connection(readonly=True) as conn:
+                member_ids = [row['id'] for row in conn.execute("SELECT id FROM members ORDER BY id")]
+            if not member_ids:
+                raise ValueError(f"{db_path} has no members to benchmark.")
+
+            for name, case in _benchmark_cases(rng, member_ids, temp_dir):
+                if only and name not in only:
+                    continue
+                count = iterations or DEFAULT_ITERATIONS[name]
+                samples = []
+                for _ in range(count):
+                    fn = case()
+                    started = time.perf_counter()
+                    fn()
+                    samples.append(time.perf_counter() - started)
+                results['benchmarks'][name] = _summary(samples)
+                summary = results['benchmarks'][name]
+                print(f"{name:32} median {summary['medianMs']:10.3f} ms   p95 {summary['p95Ms']:10.3f} ms   "
+                      f"({count} runs)")
+        finally:
+            db_utils.close_connections()
+    return results
+
+
+def compare_results(previous, current, threshold=REGRESSION_THRESHOLD):
+    """Prints median changes per benchmark; returns the names that regressed beyond threshold."""
+    regressions = []
+    print(f"Comparing against {previous.get('commit') or 'unknown commit'} ({previous.get('createdAt')}):")
+    for name, summary in current['benchmarks'].items():
+        old = previous.get('benchmarks', {}).get(name)
+        if not old or not old['medianMs']:
+            print(f"  {name:32} (no previous result)")
+            continue
+        ratio = summary['medianMs'] / old['medianMs']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"  {name:32} {old['medianMs']:10.3f} -> {summary['medianMs']:10.3f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the database layer against a synthetic dataset.')
+    parser.add_argument('--db', required=True, help='Dataset to benchmark (generated first if it does not exist)')
+    parser.add_argument('--members', type=int, default=10000, help='Members to generate when --db does not exist')
+    parser.add_argument('--payments', type=int, help='Approximate payments to generate when --db does not exist')
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, help='Runs per benchmark (default: per-benchmark)')
+    parser.add_argument('--only', help='Comma-separated benchmark names')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the JSON results')
+    parser.add_argument('--compare', help='Previous results file; exits 1 if any median regressed')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        synthetic_data.generate_dataset(args.db, args.members, args.payments, args.years, args.seed)
+    only = set(args.only.split(',')) if args.only else None
+    results = run_benchmarks(args.db, args.iterations, only, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare_results(previous, results, args.threshold):
+            sys.exit(1)
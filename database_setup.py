@@ -1,9 +1,12 @@
 import sqlite3
 import os
 import random
+import re
 import string
 from datetime import datetime, timedelta
 
+import ledger
+
 DB_PATH = os.path.join(os.path.dirname(__file__), 'gym_data.sqlite')
 
 def generate_id():
@@ -18,11 +21,43 @@ def get_db_connection():
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
-def init_db(populate_with_sample_data=False):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+# Payments count towards the month of appliedToPeriodStartDate, as in renderSalesChart
+REBUILD_MONTHLY_REVENUE_SQL = """
+        DELETE FROM monthly_revenue;
+        INSERT INTO monthly_revenue (year, month, paymentType, gender, total, paymentCount)
+        SELECT CAST(substr(p.appliedToPeriodStartDate, 1, 4) AS INTEGER), CAST(substr(p.appliedToPeriodStartDate, 6, 2) AS INTEGER),
+               p.paymentType, COALESCE(m.gender, ''), SUM(p.amount), COUNT(*)
+        FROM payments p JOIN members m ON m.id = p.memberId
+        WHERE p.appliedToPeriodStartDate GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+        GROUP BY 1, 2, 3, 4;
+"""
 
-    cursor.executescript("""
+# Search document for one member: the FTS rowid is the member's member_search_keys.docId (an
+# explicit INTEGER PRIMARY KEY, unlike members.rowid, which VACUUM may renumber), and `digits`
+# holds mobile/CNIC without separators so '352021234' finds '35202-1234567-1'
+MEMBER_SEARCH_SELECT_SQL = """
+        SELECT k.docId, m.id, m.name, m.mobile, m.email, m.cnic,
+               trim(replace(replace(replace(COALESCE(m.mobile, ''), '-', ''), ' ', ''), '+', '') || ' ' ||
+                    replace(replace(COALESCE(m.cnic, ''), '-', ''), ' ', ''))
+        FROM members m JOIN member_search_keys k ON k.memberId = m.id
+"""
+# Recreating the table is several times faster than deleting every row from it
+REBUILD_MEMBER_SEARCH_SQL = f"""
+        INSERT OR IGNORE INTO member_search_keys (memberId) SELECT id FROM members;
+        DROP TABLE IF EXISTS members_fts;
+        CREATE VIRTUAL TABLE members_fts USING fts5(
+            memberId UNINDEXED, name, mobile, email, cnic, digits,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+        INSERT INTO members_fts (rowid, memberId, name, mobile, email, cnic, digits) {MEMBER_SEARCH_SELECT_SQL};
+"""
+
+# Ordered schema migrations; PRAGMA user_version records how many have been applied.
+# Never edit an entry once released -- append a new one instead.
+MIGRATIONS = [
+    # 1: base schema (IF NOT EXISTS so databases created before versioning adopt it as-is)
+    """
         CREATE TABLE IF NOT EXISTS members (
             id TEXT PRIMARY KEY,
             name TEXT NOT NULL,
@@ -78,8 +113,228 @@ def init_db(populate_with_sample_data=False):
             notes TEXT,
             FOREIGN KEY (memberId) REFERENCES members(id) ON DELETE CASCADE
         );
-    """)
-    conn.commit()
+
+        CREATE TABLE IF NOT EXISTS member_balances (
+            memberId TEXT PRIMARY KEY,
+            gender TEXT,
+            status TEXT NOT NULL,
+            monthlyFee REAL NOT NULL DEFAULT 0,
+            overdueAmount REAL NOT NULL DEFAULT 0,
+            overdueSince TEXT,
+            asOfDate TEXT NOT NULL,
+            validUntil TEXT NOT NULL,
+            FOREIGN KEY (memberId) REFERENCES members(id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_member_balances_valid_until ON member_balances (validUntil);
+
+        CREATE TABLE IF NOT EXISTS change_log (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entityId TEXT NOT NULL,
+            op TEXT NOT NULL,
+            changedAt TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+    """,
+    # 2: secondary indexes for per-member lookups, date ordering and ON DELETE CASCADE
+    """
+        CREATE INDEX IF NOT EXISTS idx_member_status_history_member ON member_status_history (memberId, effectiveDate, id);
+        CREATE INDEX IF NOT EXISTS idx_member_monthly_fee_history_member ON member_monthly_fee_history (memberId, effectiveDate, id);
+        CREATE INDEX IF NOT EXISTS idx_member_payment_cycle_day_history_member ON member_payment_cycle_day_history (memberId, effectiveDate, id);
+        CREATE INDEX IF NOT EXISTS idx_payments_member_period ON payments (memberId, appliedToPeriodStartDate);
+        CREATE INDEX IF NOT EXISTS idx_payments_date ON payments (date);
+        CREATE INDEX IF NOT EXISTS idx_writeoffs_member_period ON writeoffs (memberId, periodStartDate);
+        CREATE INDEX IF NOT EXISTS idx_writeoffs_date ON writeoffs (date);
+    """,
+    # 3: monthly revenue rollup for the sales chart, backfilled from existing payments
+    """
+        CREATE TABLE IF NOT EXISTS monthly_revenue (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            paymentType TEXT NOT NULL,
+            gender TEXT NOT NULL DEFAULT '',
+            total REAL NOT NULL DEFAULT 0,
+            paymentCount INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (year, month, paymentType, gender)
+        );
+        CREATE INDEX IF NOT EXISTS idx_payments_applied_period ON payments (appliedToPeriodStartDate);
+    """ + REBUILD_MONTHLY_REVENUE_SQL,
+    # 4: full-text/prefix search over member name, mobile, email and CNIC (keyed by members.rowid
+    # as released; migration 8 moves the keys to member_search_keys)
+    """
+        DROP TABLE IF EXISTS members_fts;
+        CREATE VIRTUAL TABLE members_fts USING fts5(
+            memberId UNINDEXED, name, mobile, email, cnic, digits,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+        INSERT INTO members_fts (rowid, memberId, name, mobile, email, cnic, digits)
+        SELECT rowid, id, name, mobile, email, cnic,
+               trim(replace(replace(replace(COALESCE(mobile, ''), '-', ''), ' ', ''), '+', '') || ' ' ||
+                    replace(replace(COALESCE(cnic, ''), '-', ''), ' ', ''))
+        FROM members;
+    """,
+    # 5: member_balances doubles as the members list: name/joinDate copies plus one index per sort order
+    """
+        ALTER TABLE member_balances ADD COLUMN name TEXT;
+        ALTER TABLE member_balances ADD COLUMN joinDate TEXT;
+        UPDATE member_balances SET
+            name = (SELECT m.name FROM members m WHERE m.id = member_balances.memberId),
+            joinDate = (SELECT m.joinDate FROM members m WHERE m.id = member_balances.memberId);
+        CREATE INDEX IF NOT EXISTS idx_member_balances_name ON member_balances (name COLLATE NOCASE, memberId);
+        CREATE INDEX IF NOT EXISTS idx_member_balances_join_date ON member_balances (joinDate, memberId);
+        CREATE INDEX IF NOT EXISTS idx_member_balances_status ON member_balances (status, name COLLATE NOCASE, memberId);
+        CREATE INDEX IF NOT EXISTS idx_member_balances_overdue ON member_balances (overdueAmount, memberId);
+    """,
+    # 6: history indexes also cover `value`, so effective-value lookups never touch the tables
+    """
+        DROP INDEX IF EXISTS idx_member_status_history_member;
+        DROP INDEX IF EXISTS idx_member_monthly_fee_history_member;
+        DROP INDEX IF EXISTS idx_member_payment_cycle_day_history_member;
+        CREATE INDEX IF NOT EXISTS idx_member_status_history_member_value ON member_status_history (memberId, effectiveDate, id, value);
+        CREATE INDEX IF NOT EXISTS idx_member_monthly_fee_history_member_value ON member_monthly_fee_history (memberId, effectiveDate, id, value);
+        CREATE INDEX IF NOT EXISTS idx_member_payment_cycle_day_history_member_value ON member_payment_cycle_day_history (memberId, effectiveDate, id, value);
+    """,
+    # 7: indexes a bulk import (deferIndexes) has dropped, so they can be recreated if it never finishes
+    """
+        CREATE TABLE IF NOT EXISTS deferred_indexes (
+            name TEXT PRIMARY KEY,
+            sql TEXT NOT NULL
+        );
+    """,
+    # 8: stable search document ids, so members_fts survives a VACUUM renumbering members.rowid
+    """
+        CREATE TABLE IF NOT EXISTS member_search_keys (
+            docId INTEGER PRIMARY KEY,
+            memberId TEXT NOT NULL UNIQUE,
+            FOREIGN KEY (memberId) REFERENCES members(id) ON DELETE CASCADE
+        );
+    """ + REBUILD_MEMBER_SEARCH_SQL,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def schema_is_current(db_path=None):
+    """True if the database exists, has every migration applied and no deferred indexes (nothing written)."""
+    db_path = db_path or DB_PATH
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        if get_schema_version(conn) < SCHEMA_VERSION:
+            return False
+        return not conn.execute("SELECT EXISTS (SELECT 1 FROM deferred_indexes)").fetchone()[0]
+    finally:
+        conn.close()
+
+def restore_deferred_indexes(conn=None):
+    """Recreates indexes dropped by a bulk import that has not put them back (e.g. it was killed)."""
+    own_connection = conn is None
+    conn = conn or get_db_connection()
+    try:
+        indexes = conn.execute("SELECT name, sql FROM deferred_indexes").fetchall()
+        for name, sql in indexes:
+            # sqlite_master keeps CREATE INDEX without IF NOT EXISTS; another process may have restored it already
+            conn.execute(re.sub(r'^CREATE (UNIQUE )?INDEX ', r'CREATE \1INDEX IF NOT EXISTS ', sql))
+            conn.execute("DELETE FROM deferred_indexes WHERE name = ?", (name,))
+        conn.commit()
+        if indexes:
+            print(f"Recreated {len(indexes)} deferred index(es).")
+        return len(indexes)
+    finally:
+        if own_connection:
+            conn.close()
+
+def _split_statements(script):
+    # executescript would commit the open transaction first, so migrations run statement by statement
+    statements, current = [], ''
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+def run_migrations(conn):
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return 0
+    applied = 0
+    for version in range(1, SCHEMA_VERSION + 1):
+        # Each migration and its version bump commit atomically. The version is re-read under the
+        # write lock: another worker starting at the same time may have applied it already.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in _split_statements(MIGRATIONS[version - 1]):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied += 1
+        print(f"Applied schema migration {version}.")
+    if applied:
+        conn.execute("ANALYZE")
+        conn.commit()
+    return applied
+
+def rebuild_monthly_revenue(conn=None):
+    """Recomputes the monthly_revenue rollup from scratch in one transaction."""
+    own_connection = conn is None
+    conn = conn or get_db_connection()
+    try:
+        conn.executescript(f"BEGIN;\n{REBUILD_MONTHLY_REVENUE_SQL}\nCOMMIT;")
+        print("Monthly revenue rollup rebuilt.")
+    finally:
+        if own_connection:
+            conn.close()
+
+def rebuild_member_search(conn=None):
+    """Re-indexes every member in members_fts in one transaction."""
+    own_connection = conn is None
+    conn = conn or get_db_connection()
+    try:
+        conn.executescript(f"BEGIN;\n{REBUILD_MEMBER_SEARCH_SQL}\nCOMMIT;")
+        print("Member search index rebuilt.")
+    finally:
+        if own_connection:
+            conn.close()
+
+def populate_member_balances(conn=None):
+    """Computes member_balances rows for members that have none (sample data, databases from before migration 1)."""
+    own_connection = conn is None
+    conn = conn or get_db_connection()
+    try:
+        missing_ids = [row[0] for row in conn.execute("""
+            SELECT m.id FROM members m LEFT JOIN member_balances b ON b.memberId = m.id WHERE b.memberId IS NULL
+        """).fetchall()]
+        for i in range(0, len(missing_ids), 500):
+            for member_id in missing_ids[i:i + 500]:
+                ledger.refresh_member_balance(conn, member_id)
+            conn.commit()
+        if missing_ids:
+            print(f"Member balances computed for {len(missing_ids)} member(s).")
+        return len(missing_ids)
+    finally:
+        if own_connection:
+            conn.close()
+
+def init_db(populate_with_sample_data=False):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    applied = run_migrations(conn)
+    if applied:
+        print(f"Database schema migrated to version {SCHEMA_VERSION} ({applied} migration(s) applied).")
+        # Members that predate member_balances (migration 1) have no row yet
+        populate_member_balances(conn)
+    restore_deferred_indexes(conn)
     print("Database schema checked/initialized.")
 
     if populate_with_sample_data:
@@ -147,6 +402,9 @@ def init_db(populate_with_sample_data=False):
                                 VALUES (?, ?, ?, ?, ?, ?)
                             """, (generate_id(), member['id'], member['joinDate'], member['joinDate'], 'Monthly Fee', fee_entry['value']))
                 conn.commit()
+                rebuild_monthly_revenue(conn)
+                rebuild_member_search(conn)
+                populate_member_balances(conn)
                 print("Sample data populated.")
             except Exception as e:
                 conn.rollback()
@@ -157,5 +415,13 @@ def init_db(populate_with_sample_data=False):
     conn.close()
 
 if __name__ == '__main__':
-    # Initialize DB with sample data if run directly
-    init_db(populate_with_sample_data=True)
\ No newline at end of file
+    import sys
+    if '--rebuild-revenue' in sys.argv:
+        init_db(populate_with_sample_data=False)
+        rebuild_monthly_revenue()
+    elif '--rebuild-search' in sys.argv:
+        init_db(populate_with_sample_data=False)
+        rebuild_member_search()
+    else:
+        # Initialize DB with sample data if run directly
+        init_db(populate_with_sample_data=True)
\ No newline at end of file
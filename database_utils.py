@@ -1,73 +1,223 @@
 import sqlite3
+import base64
 import os
+import json
+import re
 import random
 import string
+import threading
 from contextlib import contextmanager
+from datetime import date
+from itertools import groupby
+from operator import itemgetter
+
+import database_setup
+import db_pool
+import ledger
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'gym_data.sqlite')
 
 def generate_id():
     return '_' + ''.join(random.choices(string.ascii_lowercase + string.digits, k=9))
 
+_connection_manager = None
+_connection_manager_lock = threading.Lock()
+_transaction_state = threading.local()
+
+def get_connection_manager():
+    global _connection_manager
+    if _connection_manager is None:
+        with _connection_manager_lock:
+            if _connection_manager is None:
+                _connection_manager = db_pool.ConnectionManager(DB_PATH)
+    return _connection_manager
+
+def set_connection_manager(manager):
+    """Swaps the connection engine (e.g. a manager on a temporary database in tests)."""
+    global _connection_manager
+    with _connection_manager_lock:
+        previous, _connection_manager = _connection_manager, manager
+    if previous is not None and previous is not manager:
+        previous.close()
+
+def get_pool_stats():
+    return get_connection_manager().stats()
+
+def close_connections():
+    set_connection_manager(None)
+
 @contextmanager
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    try:
+def get_db_connection(readonly=False):
+    with get_connection_manager().connection(readonly=readonly) as conn:
         yield conn
-    finally:
-        conn.close()
 
-def get_all_data():
+@contextmanager
+def transaction():
+    """Write transaction; nested calls on the same thread join the outermost one, which commits."""
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        members_list = [dict(row) for row in cursor.execute('SELECT * FROM members ORDER BY name').fetchall()]
-        payments_list = [dict(row) for row in cursor.execute('SELECT * FROM payments ORDER BY date DESC').fetchall()]
-        writeoffs_list = [dict(row) for row in cursor.execute('SELECT * FROM writeoffs ORDER BY date DESC').fetchall()]
-
-        status_histories = {}
-        for row in cursor.execute('SELECT * FROM member_status_history ORDER BY effectiveDate, id').fetchall():
-            if row['memberId'] not in status_histories:
-                status_histories[row['memberId']] = []
-            status_histories[row['memberId']].append(dict(row))
-
-        fee_histories = {}
-        for row in cursor.execute('SELECT * FROM member_monthly_fee_history ORDER BY effectiveDate, id').fetchall():
-            if row['memberId'] not in fee_histories:
-                fee_histories[row['memberId']] = []
-            fee_histories[row['memberId']].append(dict(row))
-        
-        cycle_day_histories = {}
-        for row in cursor.execute('SELECT * FROM member_payment_cycle_day_history ORDER BY effectiveDate, id').fetchall():
-            if row['memberId'] not in cycle_day_histories:
-                cycle_day_histories[row['memberId']] = []
-            cycle_day_histories[row['memberId']].append(dict(row))
-
-        for member in members_list:
-            member['statusHistory'] = status_histories.get(member['id'], [])
-            member['monthlyFeeHistory'] = fee_histories.get(member['id'], [])
-            member['paymentCycleDayHistory'] = cycle_day_histories.get(member['id'], [])
-            
-        return {"members": members_list, "payments": payments_list, "writeoffs": writeoffs_list}
+        depth = getattr(_transaction_state, 'depth', 0)
+        _transaction_state.depth = depth + 1
+        try:
+            if depth == 0 and not conn.in_transaction:
+                # IMMEDIATE: take the write lock up front, so the reads that writes are based on
+                # (previous amounts, history counts) cannot change before this transaction commits
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            if depth == 0:
+                conn.commit()
+        except Exception:
+            if depth == 0:
+                conn.rollback()
+            raise
+        finally:
+            _transaction_state.depth = depth
+
+def _record_change(conn, entity, entity_id, op='upsert'):
+    conn.execute("INSERT INTO change_log (entity, entityId, op) VALUES (?, ?, ?)", (entity, entity_id, op))
+
+def _current_change_version(cursor):
+    return cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM change_log").fetchone()['version']
+
+def get_write_generation():
+    with get_db_connection(readonly=True) as conn:
+        return _current_change_version(conn.cursor())
+
+def get_all_data():
+    with get_db_connection(readonly=True) as conn:
+        conn.execute("BEGIN")  # one read transaction: the rows and the version come from the same snapshot
+        try:
+            cursor = conn.cursor()
+            # Read the version first, as get_members_as_of does
+            version = _current_change_version(cursor)
+            members_list = [dict(row) for row in cursor.execute('SELECT * FROM members ORDER BY name').fetchall()]
+            payments_list = [dict(row) for row in cursor.execute('SELECT * FROM payments ORDER BY date DESC').fetchall()]
+            writeoffs_list = [dict(row) for row in cursor.execute('SELECT * FROM writeoffs ORDER BY date DESC').fetchall()]
+
+            status_histories = {}
+            for row in cursor.execute('SELECT * FROM member_status_history ORDER BY effectiveDate, id').fetchall():
+                if row['memberId'] not in status_histories:
+                    status_histories[row['memberId']] = []
+                status_histories[row['memberId']].append(dict(row))
+
+            fee_histories = {}
+            for row in cursor.execute('SELECT * FROM member_monthly_fee_history ORDER BY effectiveDate, id').fetchall():
+                if row['memberId'] not in fee_histories:
+                    fee_histories[row['memberId']] = []
+                fee_histories[row['memberId']].append(dict(row))
+
+            cycle_day_histories = {}
+            for row in cursor.execute('SELECT * FROM member_payment_cycle_day_history ORDER BY effectiveDate, id').fetchall():
+                if row['memberId'] not in cycle_day_histories:
+                    cycle_day_histories[row['memberId']] = []
+                cycle_day_histories[row['memberId']].append(dict(row))
+
+            for member in members_list:
+                member['statusHistory'] = status_histories.get(member['id'], [])
+                member['monthlyFeeHistory'] = fee_histories.get(member['id'], [])
+                member['paymentCycleDayHistory'] = cycle_day_histories.get(member['id'], [])
+
+            return {"members": members_list, "payments": payments_list, "writeoffs": writeoffs_list, "version": version}
+        finally:
+            conn.rollback()
+
+def _history_merger(conn, table_name):
+    # Walks one history table in memberId order alongside the members cursor
+    groups = groupby(conn.execute(f'SELECT * FROM {table_name} ORDER BY memberId, effectiveDate, id'),
+                     key=itemgetter('memberId'))
+    current = next(groups, None)
+
+    def take(member_id):
+        nonlocal current
+        while current and current[0] < member_id:
+            current = next(groups, None)
+        if current and current[0] == member_id:
+            rows = [dict(r) for r in current[1]]
+            current = next(groups, None)
+            return rows
+        return []
+    return take
+
+def iter_all_data_ndjson(batch_size=500):
+    """Yields get_all_data() as NDJSON chunks, one {"type", "data"} record per row."""
+    with get_db_connection(readonly=True) as conn:
+        conn.execute("BEGIN")  # one read transaction so every cursor sees the same snapshot
+        try:
+            version = _current_change_version(conn.cursor())
+            yield json.dumps({"type": "meta", "data": {"version": version}}) + "\n"
+
+            take_status = _history_merger(conn, 'member_status_history')
+            take_fee = _history_merger(conn, 'member_monthly_fee_history')
+            take_cycle_day = _history_merger(conn, 'member_payment_cycle_day_history')
+
+            def member_records():
+                for row in conn.execute('SELECT * FROM members ORDER BY id'):
+                    member = dict(row)
+                    member['statusHistory'] = take_status(member['id'])
+                    member['monthlyFeeHistory'] = take_fee(member['id'])
+                    member['paymentCycleDayHistory'] = take_cycle_day(member['id'])
+                    yield "member", member
+
+            def table_records(record_type, table_name):
+                for row in conn.execute(f'SELECT * FROM {table_name} ORDER BY date DESC'):
+                    yield record_type, dict(row)
+
+            for records in (member_records(), table_records("payment", "payments"), table_records("writeoff", "writeoffs")):
+                lines = []
+                for record_type, record in records:
+                    lines.append(json.dumps({"type": record_type, "data": record}))
+                    if len(lines) >= batch_size:
+                        yield "\n".join(lines) + "\n"
+                        lines = []
+                if lines:
+                    yield "\n".join(lines) + "\n"
+        finally:
+            conn.rollback()
+
+def _fetch_member(cursor, member_id):
+    member_row = cursor.execute('SELECT * FROM members WHERE id = ?', (member_id,)).fetchone()
+    if member_row:
+        member = dict(member_row)
+        member['statusHistory'] = [dict(r) for r in cursor.execute('SELECT * FROM member_status_history WHERE memberId = ? ORDER BY effectiveDate, id', (member_id,)).fetchall()]
+        member['monthlyFeeHistory'] = [dict(r) for r in cursor.execute('SELECT * FROM member_monthly_fee_history WHERE memberId = ? ORDER BY effectiveDate, id', (member_id,)).fetchall()]
+        member['paymentCycleDayHistory'] = [dict(r) for r in cursor.execute('SELECT * FROM member_payment_cycle_day_history WHERE memberId = ? ORDER BY effectiveDate, id', (member_id,)).fetchall()]
+        return member
+    return None
 
 def get_member_by_id(member_id):
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        member_row = cursor.execute('SELECT * FROM members WHERE id = ?', (member_id,)).fetchone()
-        if member_row:
-            member = dict(member_row)
-            member['statusHistory'] = [dict(r) for r in cursor.execute('SELECT * FROM member_status_history WHERE memberId = ? ORDER BY effectiveDate, id', (member_id,)).fetchall()]
-            member['monthlyFeeHistory'] = [dict(r) for r in cursor.execute('SELECT * FROM member_monthly_fee_history WHERE memberId = ? ORDER BY effectiveDate, id', (member_id,)).fetchall()]
-            member['paymentCycleDayHistory'] = [dict(r) for r in cursor.execute('SELECT * FROM member_payment_cycle_day_history WHERE memberId = ? ORDER BY effectiveDate, id', (member_id,)).fetchall()]
-            return member
-        return None
+    with get_db_connection(readonly=True) as conn:
+        return _fetch_member(conn.cursor(), member_id)
+
+def _sync_history(cursor, table_name, member_id, entries):
+    # Applies only the difference between the stored history and the submitted one
+    existing = {row['id']: (row['value'], row['effectiveDate']) for row in cursor.execute(
+        f"SELECT id, value, effectiveDate FROM {table_name} WHERE memberId = ?", (member_id,)).fetchall()}
+    submitted_ids = {entry['id'] for entry in entries}
+
+    inserts = [(e['id'], member_id, e.get('value'), e.get('effectiveDate')) for e in entries if e['id'] not in existing]
+    updates = [(e.get('value'), e.get('effectiveDate'), e['id'], member_id) for e in entries
+               if e['id'] in existing and existing[e['id']] != (e.get('value'), e.get('effectiveDate'))]
+    deletes = [(entry_id, member_id) for entry_id in existing if entry_id not in submitted_ids]
+
+    if deletes:
+        cursor.executemany(f"DELETE FROM {table_name} WHERE id = ? AND memberId = ?", deletes)
+    if updates:
+        cursor.executemany(f"UPDATE {table_name} SET value = ?, effectiveDate = ? WHERE id = ? AND memberId = ?", updates)
+    if inserts:
+        cursor.executemany(f"INSERT INTO {table_name} (id, memberId, value, effectiveDate) VALUES (?, ?, ?, ?)", inserts)
+
+def _sync_member_search(cursor, member_id):
+    """Replaces a member's document in members_fts (removes it if the member is gone)."""
+    cursor.execute("INSERT OR IGNORE INTO member_search_keys (memberId) SELECT id FROM members WHERE id = ?", (member_id,))
+    cursor.execute("DELETE FROM members_fts WHERE rowid = (SELECT docId FROM member_search_keys WHERE memberId = ?)", (member_id,))
+    cursor.execute(f"INSERT INTO members_fts (rowid, memberId, name, mobile, email, cnic, digits) "
+                   f"{database_setup.MEMBER_SEARCH_SELECT_SQL} WHERE m.id = ?", (member_id,))
 
 def upsert_member(member_data):
-    with get_db_connection() as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
         member_id = member_data.get('id', generate_id()) # Ensure ID exists
         member_data['id'] = member_id
+        previous = cursor.execute('SELECT gender FROM members WHERE id = ?', (member_id,)).fetchone()
 
         cursor.execute("""
             INSERT INTO members (id, name, gender, mobile, email, cnic, admissionFee, joinDate)
@@ -77,37 +227,91 @@ def upsert_member(member_data):
                 cnic = excluded.cnic, admissionFee = excluded.admissionFee, joinDate = excluded.joinDate
         """, member_data)
 
-        history_tables_columns = {
-            'statusHistory': ('member_status_history', ['value', 'effectiveDate']),
-            'monthlyFeeHistory': ('member_monthly_fee_history', ['value', 'effectiveDate']),
-            'paymentCycleDayHistory': ('member_payment_cycle_day_history', ['value', 'effectiveDate'])
+        history_tables = {
+            'statusHistory': 'member_status_history',
+            'monthlyFeeHistory': 'member_monthly_fee_history',
+            'paymentCycleDayHistory': 'member_payment_cycle_day_history'
         }
 
-        for key, (table_name, columns) in history_tables_columns.items():
-            cursor.execute(f"DELETE FROM {table_name} WHERE memberId = ?", (member_id,))
-            if member_data.get(key) and isinstance(member_data[key], list):
-                for entry in member_data[key]:
-                    entry['id'] = entry.get('id') or generate_id()
-                    entry['memberId'] = member_id
-                    cols_str = ', '.join(['id', 'memberId'] + columns)
-                    placeholders = ', '.join(['?'] * (len(columns) + 2))
-                    values_to_insert = [entry['id'], entry['memberId']] + [entry.get(col) for col in columns]
-                    cursor.execute(f"INSERT INTO {table_name} ({cols_str}) VALUES ({placeholders})", values_to_insert)
-        conn.commit()
-        return get_member_by_id(member_id)
+        for key, table_name in history_tables.items():
+            entries = member_data.get(key) if isinstance(member_data.get(key), list) else []
+            for entry in entries:
+                entry['id'] = entry.get('id') or generate_id()
+                entry['memberId'] = member_id
+            _sync_history(cursor, table_name, member_id, entries)
+
+        if previous and previous['gender'] != member_data.get('gender'):
+            # Re-file this member's payments under the new gender in the revenue rollup
+            _shift_member_revenue(cursor, member_id, previous['gender'], -1)
+            _shift_member_revenue(cursor, member_id, member_data.get('gender'), 1)
+
+        _sync_member_search(cursor, member_id)
+        ledger.refresh_member_balance(conn, member_id)
+        _record_change(conn, 'member', member_id)
+        member = _fetch_member(cursor, member_id)
+        return member
 
 
 def delete_member(member_id):
-    with get_db_connection() as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
+        # Cascaded rows disappear with the member, so tombstone them explicitly
+        for entity, table_name in (('payment', 'payments'), ('writeoff', 'writeoffs')):
+            cursor.execute(f"INSERT INTO change_log (entity, entityId, op) SELECT ?, id, 'delete' FROM {table_name} WHERE memberId = ?",
+                           (entity, member_id))
+        member = cursor.execute('SELECT gender FROM members WHERE id = ?', (member_id,)).fetchone()
+        if member:
+            _shift_member_revenue(cursor, member_id, member['gender'], -1)
+            # Its member_search_keys row goes with the member (ON DELETE CASCADE)
+            cursor.execute("DELETE FROM members_fts WHERE rowid = (SELECT docId FROM member_search_keys WHERE memberId = ?)", (member_id,))
         result = cursor.execute('DELETE FROM members WHERE id = ?', (member_id,))
-        conn.commit()
+        if result.rowcount > 0:
+            _record_change(conn, 'member', member_id, 'delete')
         return result.rowcount > 0
 
+def _adjust_monthly_revenue(cursor, payment, sign):
+    applied = payment.get('appliedToPeriodStartDate')
+    if not isinstance(applied, str) or not ledger.DATE_RE.match(applied):
+        return
+    member = cursor.execute('SELECT gender FROM members WHERE id = ?', (payment['memberId'],)).fetchone()
+    if not member:
+        return
+    cursor.execute("""
+        INSERT INTO monthly_revenue (year, month, paymentType, gender, total, paymentCount) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(year, month, paymentType, gender) DO UPDATE SET
+            total = total + excluded.total, paymentCount = paymentCount + excluded.paymentCount
+    """, (int(applied[:4]), int(applied[5:7]), payment['paymentType'], member['gender'] or '',
+          sign * float(payment['amount'] or 0), sign))
+    if sign < 0:
+        cursor.execute("DELETE FROM monthly_revenue WHERE paymentCount <= 0")
+
+def _shift_member_revenue(cursor, member_id, gender, sign):
+    # Adds (sign=1) or removes (sign=-1) all of a member's payments under the given gender
+    cursor.execute("""
+        INSERT INTO monthly_revenue (year, month, paymentType, gender, total, paymentCount)
+        SELECT CAST(substr(appliedToPeriodStartDate, 1, 4) AS INTEGER), CAST(substr(appliedToPeriodStartDate, 6, 2) AS INTEGER),
+               paymentType, ?, ? * SUM(amount), ? * COUNT(*)
+        FROM payments
+        WHERE memberId = ? AND appliedToPeriodStartDate GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+        GROUP BY 1, 2, 3
+        ON CONFLICT(year, month, paymentType, gender) DO UPDATE SET
+            total = total + excluded.total, paymentCount = paymentCount + excluded.paymentCount
+    """, (gender or '', sign, sign, member_id))
+    if sign < 0:
+        cursor.execute("DELETE FROM monthly_revenue WHERE paymentCount <= 0")
+
+def _refresh_balances(conn, member_id, previous_member_id=None):
+    ledger.refresh_member_balance(conn, member_id)
+    if previous_member_id and previous_member_id != member_id:
+        ledger.refresh_member_balance(conn, previous_member_id)
+
 def upsert_payment(payment_data):
-    with get_db_connection() as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
         payment_data['id'] = payment_data.get('id') or generate_id()
+        previous = cursor.execute('SELECT * FROM payments WHERE id = ?', (payment_data['id'],)).fetchone()
+        if previous:
+            _adjust_monthly_revenue(cursor, dict(previous), -1)
         cursor.execute("""
             INSERT INTO payments (id, memberId, date, appliedToPeriodStartDate, paymentType, amount)
             VALUES (:id, :memberId, :date, :appliedToPeriodStartDate, :paymentType, :amount)
@@ -116,21 +320,29 @@ def upsert_payment(payment_data):
                 appliedToPeriodStartDate = excluded.appliedToPeriodStartDate, 
                 paymentType = excluded.paymentType, amount = excluded.amount
         """, payment_data)
-        conn.commit()
+        _adjust_monthly_revenue(cursor, payment_data, 1)
+        _refresh_balances(conn, payment_data['memberId'], previous and previous['memberId'])
+        _record_change(conn, 'payment', payment_data['id'])
         # Return the data that was passed in, as the original JS does (or fetch it)
         return payment_data 
 
 def delete_payment(payment_id):
-    with get_db_connection() as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
+        previous = cursor.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone()
+        if previous:
+            _adjust_monthly_revenue(cursor, dict(previous), -1)
         result = cursor.execute('DELETE FROM payments WHERE id = ?', (payment_id,))
-        conn.commit()
+        if previous:
+            ledger.refresh_member_balance(conn, previous['memberId'])
+            _record_change(conn, 'payment', payment_id, 'delete')
         return result.rowcount > 0
 
 def upsert_writeoff(writeoff_data):
-    with get_db_connection() as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
         writeoff_data['id'] = writeoff_data.get('id') or generate_id()
+        previous = cursor.execute('SELECT memberId FROM writeoffs WHERE id = ?', (writeoff_data['id'],)).fetchone()
         cursor.execute("""
             INSERT INTO writeoffs (id, memberId, periodStartDate, periodEndDate, amount, date, notes)
             VALUES (:id, :memberId, :periodStartDate, :periodEndDate, :amount, :date, :notes)
@@ -138,14 +350,18 @@ def upsert_writeoff(writeoff_data):
                 memberId = excluded.memberId, periodStartDate = excluded.periodStartDate, periodEndDate = excluded.periodEndDate,
                 amount = excluded.amount, date = excluded.date, notes = excluded.notes
         """, writeoff_data)
-        conn.commit()
+        _refresh_balances(conn, writeoff_data['memberId'], previous and previous['memberId'])
+        _record_change(conn, 'writeoff', writeoff_data['id'])
         return writeoff_data
 
 def delete_writeoff(writeoff_id):
-    with get_db_connection() as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
+        previous = cursor.execute('SELECT memberId FROM writeoffs WHERE id = ?', (writeoff_id,)).fetchone()
         result = cursor.execute('DELETE FROM writeoffs WHERE id = ?', (writeoff_id,))
-        conn.commit()
+        if previous:
+            ledger.refresh_member_balance(conn, previous['memberId'])
+            _record_change(conn, 'writeoff', writeoff_id, 'delete')
         return result.rowcount > 0
 
 def update_history_entry(member_id, entry_id, history_type, new_effective_date):
@@ -158,15 +374,16 @@ def update_history_entry(member_id, entry_id, history_type, new_effective_date):
         raise ValueError('Invalid history type for update')
     table_name = table_map[history_type]
 
-    with get_db_connection() as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
         result = cursor.execute(f"UPDATE {table_name} SET effectiveDate = ? WHERE id = ? AND memberId = ?",
                                 (new_effective_date, entry_id, member_id))
-        conn.commit()
         if result.rowcount > 0:
+            ledger.refresh_member_balance(conn, member_id)
+            _record_change(conn, 'member', member_id)
             return get_member_by_id(member_id)
         print(f"No changes made for history update: memberId={member_id}, entryId={entry_id}, historyType={history_type}")
-        return get_member_by_id(member_id) # Return member anyway
+        return None
 
 def delete_specific_history_entry(member_id, entry_id, history_type):
     table_map = {
@@ -178,18 +395,364 @@ def delete_specific_history_entry(member_id, entry_id, history_type):
         raise ValueError('Invalid history type for deletion')
     table_name = table_map[history_type]
 
-    with get_db_connection() as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
         count_row = cursor.execute(f"SELECT COUNT(*) as count FROM {table_name} WHERE memberId = ?", (member_id,)).fetchone()
         if count_row['count'] <= 1:
             raise ValueError("Cannot delete the only history entry of this type for the member.")
         
         result = cursor.execute(f"DELETE FROM {table_name} WHERE id = ? AND memberId = ?", (entry_id, member_id))
-        conn.commit()
         if result.rowcount > 0:
+            ledger.refresh_member_balance(conn, member_id)
+            _record_change(conn, 'member', member_id)
             return get_member_by_id(member_id)
         print(f"No entry deleted: memberId={member_id}, entryId={entry_id}, historyType={history_type}")
-        return get_member_by_id(member_id)
+        return None
+
+class BatchOperationError(ValueError):
+    def __init__(self, index, message):
+        super().__init__(f"Operation {index} failed: {message}")
+        self.index = index
+
+BATCH_OPERATIONS = {
+    'upsertMember': lambda op: upsert_member(op['data']),
+    'deleteMember': lambda op: delete_member(op['id']),
+    'upsertPayment': lambda op: upsert_payment(op['data']),
+    'deletePayment': lambda op: delete_payment(op['id']),
+    'upsertWriteoff': lambda op: upsert_writeoff(op['data']),
+    'deleteWriteoff': lambda op: delete_writeoff(op['id']),
+    'updateHistoryEntry': lambda op: update_history_entry(op['memberId'], op['entryId'], op['historyType'], op['newEffectiveDate']),
+    'deleteHistoryEntry': lambda op: delete_specific_history_entry(op['memberId'], op['entryId'], op['historyType']),
+}
+
+def run_batch(operations):
+    """Applies operations in order in one transaction; any failure rolls back all of them."""
+    results = []
+    with transaction():
+        for index, operation in enumerate(operations):
+            handler = BATCH_OPERATIONS.get(operation.get('op')) if isinstance(operation, dict) else None
+            if handler is None:
+                raise BatchOperationError(index, f"Unknown operation {operation.get('op') if isinstance(operation, dict) else operation!r}")
+            if operation['op'].startswith('upsert') and not isinstance(operation.get('data'), dict):
+                raise BatchOperationError(index, "data must be an object")
+            try:
+                result = handler(operation)
+            except KeyError as e:
+                raise BatchOperationError(index, f"Missing field {e}") from e
+            except (ValueError, sqlite3.Error) as e:
+                raise BatchOperationError(index, str(e)) from e
+            if result is False or result is None:
+                # Deletes report a missing target as False, history edits as None; in a batch that is a failed operation
+                target_id = operation.get('entryId') if 'HistoryEntry' in operation['op'] else operation.get('id')
+                raise BatchOperationError(index, f"No record with id {target_id!r}")
+            results.append({"op": operation['op'], "result": result})
+    return results
+
+def get_changes(since_version):
+    with get_db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        version = _current_change_version(cursor)
+        changes = {"version": version, "reset": since_version > version,
+                   "members": [], "payments": [], "writeoffs": [],
+                   "deleted": {"members": [], "payments": [], "writeoffs": []}}
+        if changes["reset"]:
+            # The client is ahead of this database (e.g. it was restored); it must reload /api/all-data
+            return changes
+
+        # Only the latest operation per entity matters to a client catching up
+        latest_ops = cursor.execute("""
+            SELECT c.entity, c.entityId, c.op FROM change_log c
+            JOIN (SELECT entity, entityId, MAX(version) AS version FROM change_log
+                  WHERE version > ? AND version <= ? GROUP BY entity, entityId) latest
+              ON latest.version = c.version
+            ORDER BY c.version
+        """, (since_version, version)).fetchall()
+
+        upserted = {"member": [], "payment": [], "writeoff": []}
+        for row in latest_ops:
+            if row['op'] == 'delete':
+                changes["deleted"][row['entity'] + 's'].append(row['entityId'])
+            else:
+                upserted[row['entity']].append(row['entityId'])
+
+        for member_id in upserted["member"]:
+            member = _fetch_member(cursor, member_id)
+            if member:
+                changes["members"].append(member)
+        for entity, table_name in (('payment', 'payments'), ('writeoff', 'writeoffs')):
+            ids = upserted[entity]
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                placeholders = ', '.join(['?'] * len(chunk))
+                changes[table_name].extend(dict(r) for r in cursor.execute(
+                    f"SELECT * FROM {table_name} WHERE id IN ({placeholders})", chunk).fetchall())
+        return changes
+
+def get_revenue(year=None, granularity='month', gender=None):
+    params = []
+    gender_filter = ''
+    if gender and gender != 'all':
+        gender_filter = ' AND gender = ?'
+        params.append(gender)
+
+    if granularity == 'month':
+        # Served from the rollup: at most 12 x types x genders rows per year
+        query = f"""
+            SELECT printf('%04d-%02d', year, month) AS period, paymentType, SUM(total) AS total, SUM(paymentCount) AS paymentCount
+            FROM monthly_revenue WHERE {'year = ?' if year else '1'}{gender_filter}
+            GROUP BY year, month, paymentType ORDER BY year, month
+        """
+        if year:
+            params.insert(0, year)
+    else:
+        if not year:
+            raise ValueError('year is required for week and day granularity')
+        period_sql = "strftime('%Y-W%W', p.appliedToPeriodStartDate)" if granularity == 'week' else 'p.appliedToPeriodStartDate'
+        query = f"""
+            SELECT {period_sql} AS period, p.paymentType, SUM(p.amount) AS total, COUNT(*) AS paymentCount
+            FROM payments p JOIN members m ON m.id = p.memberId
+            WHERE p.appliedToPeriodStartDate BETWEEN ? AND ?{gender_filter.replace('gender', 'm.gender')}
+            GROUP BY 1, 2 ORDER BY 1
+        """
+        params = [f"{year:04d}-01-01", f"{year:04d}-12-31"] + params
+
+    buckets = {}
+    with get_db_connection(readonly=True) as conn:
+        for row in conn.execute(query, params):
+            bucket = buckets.setdefault(row['period'], {"period": row['period'], "total": 0, "byType": {}})
+            bucket['byType'][row['paymentType']] = row['total']
+            bucket['total'] += row['total']
+    return {"year": year, "granularity": granularity, "buckets": list(buckets.values())}
+
+# Keyset orders for list_members: sort columns (ending in a unique key) and default direction.
+# Each has a matching member_balances index from schema migration 5.
+MEMBER_LIST_SORTS = {
+    'name': (('b.name COLLATE NOCASE', 'b.memberId'), 'asc'),
+    'joinDate': (('b.joinDate', 'b.memberId'), 'asc'),
+    'status': (('b.status', 'b.name COLLATE NOCASE', 'b.memberId'), 'asc'),
+    'overdue': (('b.overdueAmount', 'b.memberId'), 'desc'),
+}
+MEMBER_LIST_COLUMNS = """
+    m.id, m.name, m.gender, m.mobile, m.email, m.cnic, m.admissionFee, m.joinDate,
+    b.status, b.monthlyFee, b.overdueAmount, b.overdueSince
+"""
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    return values
+
+def list_members(page_size=50, cursor=None, sort='name', direction=None, gender=None, status=None):
+    """One page of members with their current status and balance, in keyset order."""
+    if sort not in MEMBER_LIST_SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(MEMBER_LIST_SORTS)}")
+    sort_columns, default_direction = MEMBER_LIST_SORTS[sort]
+    direction = direction or default_direction
+    if direction not in ('asc', 'desc'):
+        raise ValueError("direction must be asc or desc")
+
+    _roll_forward_if_stale()
+    filters, params = [], []
+    if gender and gender != 'all':
+        filters.append("b.gender = ?")
+        params.append(gender)
+    if status and status != 'all':
+        filters.append("b.status = ? COLLATE NOCASE")
+        params.append(status)
+    count_filters, count_params = list(filters), list(params)
+    if cursor:
+        comparison = '>' if direction == 'asc' else '<'
+        values = _decode_cursor(cursor, len(sort_columns))
+        # The leading bound lets SQLite seek the index; the row value makes the cut exact
+        filters.append(f"{sort_columns[0]} {comparison}= ? AND "
+                       f"({', '.join(sort_columns)}) {comparison} ({', '.join(['?'] * len(sort_columns))})")
+        params.extend([values[0]] + values)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    order = ', '.join(f"{column} {direction.upper()}" for column in sort_columns)
+    cursor_columns = ', '.join(f"{column.split(' ')[0]} AS _k{i}" for i, column in enumerate(sort_columns))
+
+    with get_db_connection(readonly=True) as conn:
+        rows = conn.execute(f"""
+            SELECT {MEMBER_LIST_COLUMNS}, {cursor_columns}
+            FROM member_balances b JOIN members m ON m.id = b.memberId
+            {where}
+            ORDER BY {order}
+            LIMIT ?
+        """, params + [page_size + 1]).fetchall()
+        page = {'members': [], 'nextCursor': None, 'pageSize': page_size, 'sort': sort, 'direction': direction}
+        if not cursor:
+            # Only the first page pays for the total
+            count_where = f"WHERE {' AND '.join(count_filters)}" if count_filters else ""
+            page['total'] = conn.execute(f"SELECT COUNT(*) FROM member_balances b {count_where}", count_params).fetchone()[0]
+
+    for row in rows[:page_size]:
+        page['members'].append({key: row[key] for key in row.keys() if not key.startswith('_k')})
+    if len(rows) > page_size:
+        last = rows[page_size - 1]
+        page['nextCursor'] = _encode_cursor([last[f'_k{i}'] for i in range(len(sort_columns))])
+    return page
+
+def _member_search_tokens(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+def search_members(text, limit=20):
+    tokens = _member_search_tokens(text)
+    if not tokens:
+        return []
+    # Every word must match as a prefix of some indexed token; quoting neutralises FTS syntax
+    match = ' '.join(f'"{token}"*' for token in tokens)
+    # Rank inside the FTS table and join only the top rows. A lone letter matches most of
+    # the roster, so ranking it would cost a full scoring pass for no useful order.
+    order = '' if max(map(len, tokens)) < 2 else 'ORDER BY bm25(members_fts, 0.0, 10.0, 4.0, 2.0, 4.0, 4.0)'
+    with get_db_connection(readonly=True) as conn:
+        rows = conn.execute(f"""
+            SELECT m.id, m.name, m.gender, m.mobile, m.email, m.cnic, m.joinDate,
+                   b.status, b.overdueAmount
+            FROM (
+                SELECT memberId, row_number() OVER () AS position FROM (
+                    SELECT memberId FROM members_fts WHERE members_fts MATCH ? {order} LIMIT ?)
+            ) hits
+            JOIN members m ON m.id = hits.memberId
+            LEFT JOIN member_balances b ON b.memberId = m.id
+            ORDER BY hits.position
+        """, (match, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+def _effective_value_sql(table_name, alias):
+    # Latest entry on or before :asOf, later id winning ties, as getEffectiveValue does
+    return f"""(SELECT h.value FROM {table_name} h
+                 WHERE h.memberId = m.id AND h.effectiveDate <= :asOf
+                   AND h.effectiveDate GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+                 ORDER BY h.effectiveDate DESC, h.id DESC LIMIT 1) AS {alias}"""
+
+MEMBERS_AS_OF_SQL = f"""
+    SELECT id, name, gender, joinDate, COALESCE(status, 'Inactive') AS status,
+           COALESCE(monthlyFee, 0) AS monthlyFee, paymentCycleDay
+    FROM (
+        SELECT m.id, m.name, m.gender, m.joinDate,
+               {_effective_value_sql('member_status_history', 'status')},
+               {_effective_value_sql('member_monthly_fee_history', 'monthlyFee')},
+               {_effective_value_sql('member_payment_cycle_day_history', 'paymentCycleDay')}
+        FROM members m
+        ORDER BY m.id
+    )
+"""
+
+def get_members_as_of(as_of):
+    """Every member's effective status, monthly fee and payment cycle day on as_of (YYYY-MM-DD)."""
+    with get_db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        # Read the version first: the rows are then at least this new
+        version = _current_change_version(cursor)
+        members = [dict(row) for row in cursor.execute(MEMBERS_AS_OF_SQL, {'asOf': as_of})]
+    return {'date': as_of, 'version': version, 'members': members}
+
+def get_member_ledger(member_id, until=None, today=None):
+    today = today or date.today()
+    projection_end = until or date(today.year, 12, 31)
+    with get_db_connection(readonly=True) as conn:
+        data = ledger.load_member_ledger_data(conn, member_id)
+        if not data:
+            return None
+        details = ledger.member_overdue_details(data, today)
+        return {
+            'memberId': member_id,
+            'until': projection_end.isoformat(),
+            'overdueAmount': ledger.member_overdue_amount(data, today),
+            'daysOverdue': details['daysOverdue'],
+            'entries': ledger.generate_ledger_entries(data, projection_end),
+        }
+
+def roll_forward_balances(today=None):
+    # Recomputes member_balances rows that are missing or whose period has rolled over, 500 members
+    # per write transaction. Each chunk is selected under the write lock, so workers that run this
+    # at the same time share the work instead of each recomputing every stale member.
+    today = today or date.today()
+    today_str = today.isoformat()
+    recomputed = 0
+    last_id = ''
+    with get_db_connection() as conn:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                stale_ids = [row['id'] for row in conn.execute("""
+                    SELECT m.id FROM members m
+                    LEFT JOIN member_balances b ON b.memberId = m.id
+                    WHERE m.id > ? AND (b.memberId IS NULL OR b.validUntil < ? OR b.asOfDate > ?)
+                    ORDER BY m.id LIMIT 500
+                """, (last_id, today_str, today_str)).fetchall()]
+                for member_id in stale_ids:
+                    ledger.refresh_member_balance(conn, member_id, today)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if not stale_ids:
+                break
+            recomputed += len(stale_ids)
+            last_id = stale_ids[-1]
+    if recomputed:
+        print(f"Rolled member balances forward to {today_str}: {recomputed} member(s) recomputed.")
+    return recomputed
+
+_roll_forward_lock = threading.Lock()
+
+def _roll_forward_if_stale(today=None):
+    # Cheap probes first: an indexed seek for rolled-over rows, and index-only counts for missing ones
+    # (balances cascade-delete with their member, so fewer balances than members means some are missing)
+    today = today or date.today()
+    with get_db_connection(readonly=True) as conn:
+        stale = conn.execute("""
+            SELECT EXISTS (SELECT 1 FROM member_balances WHERE validUntil < ?)
+                OR (SELECT COUNT(*) FROM members) > (SELECT COUNT(*) FROM member_balances)
+        """, (today.isoformat(),)).fetchone()[0]
+    if stale and _roll_forward_lock.acquire(blocking=False):
+        # Reads serve the stored balances; one background thread per process brings them up to date
+        def run():
+            try:
+                roll_forward_balances(today)
+            except Exception as e:
+                print(f"Error rolling member balances forward: {e}")
+            finally:
+                _roll_forward_lock.release()
+        threading.Thread(target=run, name='balance-roll-forward', daemon=True).start()
+
+def get_metrics_summary(gender=None):
+    _roll_forward_if_stale()
+    query = """
+        SELECT COUNT(CASE WHEN status = 'Active' THEN 1 END) AS activeMembers,
+               COALESCE(SUM(CASE WHEN status = 'Active' THEN monthlyFee END), 0) AS expectedMonthlyRevenue,
+               COALESCE(SUM(overdueAmount), 0) AS totalOverdue
+        FROM member_balances
+    """
+    params = ()
+    if gender and gender != 'all':
+        query += " WHERE gender = ?"
+        params = (gender,)
+    with get_db_connection(readonly=True) as conn:
+        return dict(conn.execute(query, params).fetchone())
+
+def create_backup_snapshot(dest_path):
+    """Copies a consistent snapshot of the live database to dest_path with the online backup API.
+
+    Copies in a single step: in WAL mode that is one read transaction, which never blocks writers,
+    whereas a stepped backup restarts whenever another connection writes between steps.
+    """
+    src = sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True)
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+    return os.path.getsize(dest_path)
 
 def create_checkpoint():
     with get_db_connection() as conn:
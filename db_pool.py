@@ -0,0 +1,137 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import instrumentation
+
+# Long-lived, consistently tuned SQLite connections for database_utils. Writers and
+# readers get separate bounded pools; read-only connections never take the write lock,
+# so long reads (all-data snapshots, exports) never wait behind writers in WAL mode.
+
+COMMON_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",      # ~16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+)
+
+
+class PoolExhaustedError(sqlite3.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """A bounded pool of connections sharing one role (read-write or read-only)."""
+
+    def __init__(self, db_path, readonly=False, max_size=4, acquire_timeout=10.0):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._all = []
+        self._stats = {'created': 0, 'acquired': 0, 'waits': 0, 'waitSeconds': 0.0, 'inUse': 0}
+
+    def _connect(self):
+        # Every statement on a pooled connection is timed and counted (see instrumentation)
+        if self.readonly:
+            conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False,
+                                   factory=instrumentation.InstrumentedConnection)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                   factory=instrumentation.InstrumentedConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in COMMON_PRAGMAS + (() if self.readonly else WRITER_PRAGMAS):
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if len(self._all) < self.max_size:
+                    conn = self._connect()
+                    self._all.append(conn)
+                    self._stats['created'] += 1
+            if conn is None:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.acquire_timeout)
+                except queue.Empty:
+                    raise PoolExhaustedError(f"No {self.role} connection available after {self.acquire_timeout}s")
+                finally:
+                    with self._lock:
+                        self._stats['waits'] += 1
+                        self._stats['waitSeconds'] += time.perf_counter() - started
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['inUse'] += 1
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()  # never hand an open transaction to the next borrower
+        with self._lock:
+            self._stats['inUse'] -= 1
+        self._idle.put(conn)
+
+    @property
+    def role(self):
+        return 'read-only' if self.readonly else 'read-write'
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, role=self.role, size=len(self._all), maxSize=self.max_size,
+                        idle=self._idle.qsize())
+
+    def close(self):
+        with self._lock:
+            connections, self._all = self._all, []
+        for conn in connections:
+            conn.close()
+        self._idle = queue.LifoQueue()
+
+
+class ConnectionManager:
+    """Hands out pooled connections; nested use on one thread shares the outer connection."""
+
+    def __init__(self, db_path, max_writers=4, max_readers=8):
+        self.db_path = db_path
+        self.write_pool = ConnectionPool(db_path, readonly=False, max_size=max_writers)
+        self.read_pool = ConnectionPool(db_path, readonly=True, max_size=max_readers)
+        self._local = threading.local()
+
+    @contextmanager
+    def connection(self, readonly=False):
+        held = self._local.__dict__.setdefault('held', {})
+        # A read nested inside a write must see the writer's uncommitted rows
+        conn = held.get('rw') or (held.get('ro') if readonly else None)
+        if conn is not None:
+            yield conn
+            return
+
+        role, pool = ('ro', self.read_pool) if readonly else ('rw', self.write_pool)
+        conn = pool.acquire()
+        held[role] = conn
+        try:
+            yield conn
+        finally:
+            held.pop(role, None)
+            pool.release(conn)
+
+    def stats(self):
+        return {'dbPath': self.db_path, 'writers': self.write_pool.stats(), 'readers': self.read_pool.stats()}
+
+    def close(self):
+        self.write_pool.close()
+        self.read_pool.close()
@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date
+
+import database_utils as db_utils
+import ledger
+
+# Streaming exports for the accountant: rows go from a live cursor through a generator
+# to the response, so memory use does not depend on the size of the date range.
+
+EXPORT_COLUMNS = {
+    'payments': ['id', 'memberId', 'memberName', 'date', 'appliedToPeriodStartDate', 'paymentType', 'amount'],
+    'writeoffs': ['id', 'memberId', 'memberName', 'periodStartDate', 'periodEndDate', 'amount', 'date', 'notes'],
+    'ledger': ['memberId', 'memberName', 'periodStartDate', 'periodEndDate', 'status', 'feesDue', 'paid', 'writtenOff', 'balance'],
+}
+ROWS_PER_CHUNK = 1000
+
+
+def _table_rows(conn, table_name, date_from, date_to, member_id):
+    query = f"""
+        SELECT t.*, m.name AS memberName FROM {table_name} t JOIN members m ON m.id = t.memberId
+        WHERE t.date >= ? AND t.date <= ?
+    """
+    params = [date_from, date_to]
+    if member_id:
+        query += " AND t.memberId = ?"
+        params.append(member_id)
+    query += " ORDER BY t.date, t.id"
+    for row in conn.execute(query, params):
+        yield dict(row)
+
+
+def _ledger_rows(conn, date_from, date_to, member_id):
+    projection_end = ledger.parse_date(date_to)
+    query = "SELECT id, name FROM members"
+    params = []
+    if member_id:
+        query += " WHERE id = ?"
+        params.append(member_id)
+    for member in conn.execute(query + " ORDER BY id", params):
+        data = ledger.load_member_ledger_data(conn, member['id'])
+        if not data:
+            continue
+        for entry in ledger.generate_ledger_entries(data, projection_end):
+            if not date_from <= entry['periodStartDate'] <= date_to:
+                continue
+            paid = sum(p['amount'] for p in entry['payments'] if p['paymentType'] == 'Monthly Fee')
+            written_off = sum(w['amount'] for w in entry['writeOffs'])
+            yield {
+                'memberId': member['id'],
+                'memberName': member['name'],
+                'periodStartDate': entry['periodStartDate'],
+                'periodEndDate': entry['periodEndDate'],
+                'status': entry['status'],
+                'feesDue': entry['feesDue'],
+                'paid': paid,
+                'writtenOff': written_off,
+                'balance': entry['feesDue'] - paid - written_off,
+            }
+
+
+def _encode(rows, columns, data_format):
+    buffer = io.StringIO()
+    writer = None
+    if data_format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+    count = 0
+    for row in rows:
+        if writer:
+            writer.writerow([row.get(column) for column in columns])
+        else:
+            buffer.write(json.dumps({column: row.get(column) for column in columns}))
+            buffer.write('\n')
+        count += 1
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_export(kind, data_format='csv', date_from=None, date_to=None, member_id=None, compress=False):
+    date_from = date_from or '0000-01-01'
+    date_to = date_to or date.today().isoformat()
+
+    def chunks():
+        with db_utils.get_db_connection(readonly=True) as conn:
+            if kind == 'ledger':
+                rows = _ledger_rows(conn, date_from, date_to, member_id)
+            else:
+                rows = _table_rows(conn, kind, date_from, date_to, member_id)
+            yield from _encode(rows, EXPORT_COLUMNS[kind], data_format)
+
+    return _gzip(chunks()) if compress else chunks()
@@ -1,13 +1,19 @@
+import gzip
+import io
+import json
 import os
 import pickle
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-
+import backup_store
 import database_utils as db_utils
+import instrumentation
 
 # This scope allows the app to create files in the user's Google Drive.
 # It does NOT grant permission to read or modify existing files unless created by the app.
@@ -16,95 +22,325 @@ SCOPES = ['https://www.googleapis.com/auth/drive.file']
 CREDENTIALS_FILE = 'credentials.json'
 TOKEN_PICKLE_FILE = 'token.pickle' # Stores user's access and refresh tokens.
 BACKUP_FOLDER_NAME = 'GymApp'
+INCREMENTAL_FOLDER_NAME = 'GymApp-incremental'
+
+# The Google client libraries are slow to import, so they are imported inside the functions
+# that talk to Drive: importing this module (and the app) never pays for them.
+
+_backup_lock = threading.Lock() # Held for the duration of any backup, manual or scheduled
+
+# Drive client state is built once per process. The service is rebuilt only when the
+# token file changes (re-authorization); folder ids are remembered across restarts.
+FOLDER_CACHE_FILE = 'drive_folders.json'
+UPLOAD_CHUNK_SIZE = max(1, int(os.environ.get('GDRIVE_UPLOAD_CHUNK_MB', '8'))) * 1024 * 1024 # multiple of 256 KB
+UPLOAD_RETRIES = int(os.environ.get('GDRIVE_UPLOAD_RETRIES', '5'))
+UPLOAD_BACKOFF_MAX = 64 # seconds
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+_service_lock = threading.Lock()
+_cached_service = None
+_cached_creds = None
+_cached_token_mtime = None
+_folder_ids = None
+
+def _save_credentials(creds):
+    with open(TOKEN_PICKLE_FILE, 'wb') as token:
+        pickle.dump(creds, token)
+    return os.path.getmtime(TOKEN_PICKLE_FILE)
+
+def reset_drive_cache():
+    """Forgets the cached client and folder ids, e.g. after authorizing a different account."""
+    global _cached_service, _cached_creds, _cached_token_mtime, _folder_ids
+    with _service_lock:
+        _cached_service = _cached_creds = _cached_token_mtime = None
+        _folder_ids = {}
+        if os.path.exists(FOLDER_CACHE_FILE):
+            os.remove(FOLDER_CACHE_FILE)
 
 def get_drive_service():
     """Gets an authorized Google Drive service object."""
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens.
-    if os.path.exists(TOKEN_PICKLE_FILE):
-        with open(TOKEN_PICKLE_FILE, 'rb') as token:
-            creds = pickle.load(token)
-    
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-            except Exception as e:
-                print(f"Token refresh failed: {e}. Re-authorization is needed.")
-                # If refresh fails, delete the token file to force re-auth
-                if os.path.exists(TOKEN_PICKLE_FILE):
-                    os.remove(TOKEN_PICKLE_FILE)
-                return None # Indicate that re-authorization is required
-        else:
+    global _cached_service, _cached_creds, _cached_token_mtime
+    with _service_lock:
+        if not os.path.exists(TOKEN_PICKLE_FILE):
             # This part is handled by the web flow in app.py
             # This function should only be called when a token is expected to exist.
             print("Credentials not found or invalid. Authorization is required.")
+            _cached_service = _cached_creds = _cached_token_mtime = None
             return None
 
-        # Save the credentials for the next run
-        with open(TOKEN_PICKLE_FILE, 'wb') as token:
-            pickle.dump(creds, token)
+        token_mtime = os.path.getmtime(TOKEN_PICKLE_FILE)
+        if _cached_service is not None and token_mtime == _cached_token_mtime:
+            creds = _cached_creds
+        else:
+            # The file token.pickle stores the user's access and refresh tokens.
+            with open(TOKEN_PICKLE_FILE, 'rb') as token:
+                creds = pickle.load(token)
+            _cached_service = None
+
+        # Refresh an expired access token in place and persist it for the next run
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                from google.auth.transport.requests import Request
+                try:
+                    creds.refresh(Request())
+                except Exception as e:
+                    print(f"Token refresh failed: {e}. Re-authorization is needed.")
+                    # If refresh fails, delete the token file to force re-auth
+                    os.remove(TOKEN_PICKLE_FILE)
+                    _cached_service = _cached_creds = _cached_token_mtime = None
+                    return None # Indicate that re-authorization is required
+                token_mtime = _save_credentials(creds)
+            else:
+                print("Credentials not found or invalid. Authorization is required.")
+                return None
+
+        if _cached_service is None:
+            from googleapiclient.discovery import build
+            # cache_discovery=False: the bundled discovery document is used, no fetch or file cache
+            _cached_service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+        _cached_creds = creds
+        _cached_token_mtime = token_mtime
+        return _cached_service
+
+def _load_folder_ids():
+    global _folder_ids
+    if _folder_ids is None:
+        try:
+            with open(FOLDER_CACHE_FILE) as f:
+                _folder_ids = json.load(f)
+        except (OSError, ValueError):
+            _folder_ids = {}
+    return _folder_ids
+
+def _remember_folder(folder_name, folder_id):
+    folder_ids = _load_folder_ids()
+    if folder_id is None:
+        folder_ids.pop(folder_name, None)
+    else:
+        folder_ids[folder_name] = folder_id
+    with open(FOLDER_CACHE_FILE, 'w') as f:
+        json.dump(folder_ids, f)
 
-    return build('drive', 'v3', credentials=creds)
+def forget_folder(folder_name):
+    """Drops a remembered folder id (the folder was deleted or is no longer accessible)."""
+    _remember_folder(folder_name, None)
 
 def find_or_create_folder(service, folder_name):
     """Find a folder by name, or create it if it doesn't exist."""
+    folder_id = _load_folder_ids().get(folder_name)
+    if folder_id:
+        return folder_id
+
     query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
+    response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute(num_retries=UPLOAD_RETRIES)
     files = response.get('files', [])
 
     if files:
         print(f"Found folder '{folder_name}' with ID: {files[0].get('id')}")
-        return files[0].get('id')
+        folder_id = files[0].get('id')
     else:
         print(f"Folder '{folder_name}' not found, creating it...")
         file_metadata = {
             'name': folder_name,
             'mimeType': 'application/vnd.google-apps.folder'
         }
-        folder = service.files().create(body=file_metadata, fields='id').execute()
+        folder = service.files().create(body=file_metadata, fields='id').execute(num_retries=UPLOAD_RETRIES)
         print(f"Created folder with ID: {folder.get('id')}")
-        return folder.get('id')
+        folder_id = folder.get('id')
+    _remember_folder(folder_name, folder_id)
+    return folder_id
+
+def _is_retryable(error):
+    from googleapiclient.errors import HttpError
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    return isinstance(error, (OSError, TimeoutError))
+
+def _next_chunk_with_retry(request):
+    """next_chunk() with exponential backoff; a retried chunk resumes from the last byte Drive acknowledged."""
+    attempt = 0
+    while True:
+        try:
+            # num_retries covers quick retries inside the client; the loop below backs off further
+            return request.next_chunk(num_retries=UPLOAD_RETRIES)
+        except Exception as e:
+            if attempt >= UPLOAD_RETRIES or not _is_retryable(e):
+                raise
+            delay = min(UPLOAD_BACKOFF_MAX, 2 ** attempt) + random.random()
+            print(f"Upload chunk failed ({e}); retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            attempt += 1
+
+def _gzip_file(src_path, dest_path):
+    started = time.perf_counter()
+    with open(src_path, 'rb') as src, gzip.open(dest_path, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, length=1024 * 1024)
+    return os.path.getsize(dest_path), time.perf_counter() - started
 
-def upload_db_to_drive():
-    """Performs a DB checkpoint and uploads the database file to Google Drive."""
+def _report(progress_callback, stage, bytes_uploaded=None, total_bytes=None):
+    if progress_callback:
+        progress_callback(stage, bytes_uploaded, total_bytes)
+
+def upload_db_to_drive(progress_callback=None):
+    """Snapshots the database, compresses the snapshot and uploads it to Google Drive."""
+    if not _backup_lock.acquire(blocking=False):
+        print("Backup skipped: another backup is already running.")
+        return {"success": False, "message": "Another backup is already running."}
+    started = time.perf_counter()
+    result = {"success": False}
+    try:
+        result = _upload_db_to_drive(progress_callback)
+        return result
+    finally:
+        instrumentation.observe_backup('full', time.perf_counter() - started, result.get("success"))
+        _backup_lock.release()
+
+def _upload_db_to_drive(progress_callback):
     print("Starting database backup process...")
+    started = time.perf_counter()
+    stats = {}
     try:
-        # 1. Ensure database is ready for backup
-        db_utils.create_checkpoint()
-        print("Database checkpoint successful.")
+        with tempfile.TemporaryDirectory(prefix='gym_backup_') as temp_dir:
+            timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+            file_name = f"gym_data_{timestamp}.sqlite.gz"
+            snapshot_path = os.path.join(temp_dir, 'snapshot.sqlite')
+            compressed_path = os.path.join(temp_dir, file_name)
 
-        # 2. Get authorized Drive service
-        service = get_drive_service()
-        if not service:
-            raise ConnectionRefusedError("Not authorized with Google Drive. Please authorize first.")
+            # 1. Take a consistent snapshot without checkpointing or blocking writers
+            _report(progress_callback, 'snapshot')
+            step_started = time.perf_counter()
+            stats['snapshotBytes'] = db_utils.create_backup_snapshot(snapshot_path)
+            stats['snapshotSeconds'] = round(time.perf_counter() - step_started, 3)
+            print(f"Database snapshot taken ({stats['snapshotBytes']} bytes).")
 
-        # 3. Find or create the backup folder
-        folder_id = find_or_create_folder(service, BACKUP_FOLDER_NAME)
+            # 2. Compress on a worker thread while we talk to Drive
+            _report(progress_callback, 'compressing')
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                compression = executor.submit(_gzip_file, snapshot_path, compressed_path)
 
-        # 4. Prepare file for upload
-        timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        file_name = f"gym_data_{timestamp}.sqlite"
-        file_metadata = {
-            'name': file_name,
-            'parents': [folder_id]
-        }
-        media = MediaFileUpload(db_utils.DB_PATH, mimetype='application/x-sqlite3', resumable=True)
-
-        # 5. Upload the file
-        print(f"Uploading '{file_name}' to Google Drive...")
-        request = service.files().create(body=file_metadata, media_body=media, fields='id')
-        response = None
-        # resumable upload logic
-        while response is None:
-            status, response = request.next_chunk()
-            if status:
-                print(f"Uploaded {int(status.progress() * 100)}%")
-        
-        print(f"File upload complete. File ID: {response.get('id')}")
-        return {"success": True, "message": f"Successfully backed up as '{file_name}'."}
+                service = get_drive_service()
+                if not service:
+                    raise ConnectionRefusedError("Not authorized with Google Drive. Please authorize first.")
+                folder_id = find_or_create_folder(service, BACKUP_FOLDER_NAME)
+
+                compressed_bytes, compress_seconds = compression.result()
+            stats['compressedBytes'] = compressed_bytes
+            stats['compressSeconds'] = round(compress_seconds, 3)
+            stats['compressionRatio'] = round(stats['snapshotBytes'] / compressed_bytes, 2) if compressed_bytes else None
+
+            # 3. Upload the compressed snapshot
+            file_metadata = {
+                'name': file_name,
+                'parents': [folder_id]
+            }
+            from googleapiclient.errors import HttpError
+            from googleapiclient.http import MediaFileUpload
+            media = MediaFileUpload(compressed_path, mimetype='application/gzip', resumable=True,
+                                    chunksize=UPLOAD_CHUNK_SIZE)
+
+            print(f"Uploading '{file_name}' to Google Drive...")
+            step_started = time.perf_counter()
+            request = service.files().create(body=file_metadata, media_body=media, fields='id')
+            response = None
+            # resumable upload logic
+            _report(progress_callback, 'uploading', 0, compressed_bytes)
+            while response is None:
+                try:
+                    status, response = _next_chunk_with_retry(request)
+                except HttpError as e:
+                    if e.resp.status != 404 or stats.get('folderRetried'):
+                        raise
+                    # The remembered folder is gone; look it up again and restart the upload once
+                    forget_folder(BACKUP_FOLDER_NAME)
+                    file_metadata['parents'] = [find_or_create_folder(service, BACKUP_FOLDER_NAME)]
+                    request = service.files().create(body=file_metadata, media_body=media, fields='id')
+                    stats['folderRetried'] = True
+                    continue
+                if status:
+                    print(f"Uploaded {int(status.progress() * 100)}%")
+                    _report(progress_callback, 'uploading', status.resumable_progress, status.total_size)
+            _report(progress_callback, 'uploading', compressed_bytes, compressed_bytes)
+            stats['uploadSeconds'] = round(time.perf_counter() - step_started, 3)
+
+        stats['totalSeconds'] = round(time.perf_counter() - started, 3)
+        print(f"File upload complete. File ID: {response.get('id')}. Backup stats: {stats}")
+        return {"success": True, "message": f"Successfully backed up as '{file_name}'.",
+                "stats": dict(stats, fileName=file_name)}
 
     except Exception as e:
         print(f"An error occurred during backup: {e}")
-        return {"success": False, "message": str(e)}
\ No newline at end of file
+        return {"success": False, "message": str(e), "stats": stats}
+
+class DriveBackend:
+    """backup_store backend keeping chunks and manifests as files in one Drive folder."""
+
+    def __init__(self, service, folder_id):
+        self.service = service
+        self.folder_id = folder_id
+        self._file_ids = None
+
+    def _index(self):
+        # One paged listing per backup instead of a query per chunk
+        if self._file_ids is None:
+            self._file_ids = {}
+            page_token = None
+            while True:
+                response = self.service.files().list(
+                    q=f"'{self.folder_id}' in parents and trashed=false", spaces='drive',
+                    fields='nextPageToken, files(id, name)', pageSize=1000, pageToken=page_token).execute(num_retries=UPLOAD_RETRIES)
+                for f in response.get('files', []):
+                    self._file_ids[f['name']] = f['id']
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+        return self._file_ids
+
+    def has(self, key):
+        return key in self._index()
+
+    def put(self, key, data):
+        from googleapiclient.http import MediaIoBaseUpload
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype='application/octet-stream', resumable=False)
+        created = self.service.files().create(
+            body={'name': key, 'parents': [self.folder_id]}, media_body=media, fields='id').execute(num_retries=UPLOAD_RETRIES)
+        self._index()[key] = created.get('id')
+
+    def get(self, key):
+        from googleapiclient.http import MediaIoBaseDownload
+        buffer = io.BytesIO()
+        downloader = MediaIoBaseDownload(buffer, self.service.files().get_media(fileId=self._index()[key]))
+        done = False
+        while not done:
+            _, done = downloader.next_chunk(num_retries=UPLOAD_RETRIES)
+        return buffer.getvalue()
+
+    def list(self, prefix=''):
+        return sorted(name for name in self._index() if name.startswith(prefix))
+
+def get_incremental_backend():
+    service = get_drive_service()
+    if not service:
+        raise ConnectionRefusedError("Not authorized with Google Drive. Please authorize first.")
+    return DriveBackend(service, find_or_create_folder(service, INCREMENTAL_FOLDER_NAME))
+
+def incremental_backup_to_drive(progress_callback=None):
+    """Uploads only the database chunks Drive does not already have, plus a manifest."""
+    if not _backup_lock.acquire(blocking=False):
+        print("Incremental backup skipped: another backup is already running.")
+        return {"success": False, "message": "Another backup is already running."}
+    print("Starting incremental database backup...")
+    started = time.perf_counter()
+    success = False
+    try:
+        _report(progress_callback, 'snapshot')
+        stats = backup_store.create_incremental_backup(
+            get_incremental_backend(),
+            progress_callback=lambda done, total: _report(progress_callback, 'uploading', done, total))
+        success = True
+        return {"success": True, "message": f"Incremental backup saved as '{stats['manifest']}'.", "stats": stats}
+    except Exception as e:
+        print(f"An error occurred during incremental backup: {e}")
+        return {"success": False, "message": str(e)}
+    finally:
+        instrumentation.observe_backup('incremental', time.perf_counter() - started, success)
+        _backup_lock.release()
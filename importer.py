@@ -0,0 +1,349 @@
+import csv
+import io
+import json
+import sqlite3
+import time
+
+import database_setup
+import database_utils as db_utils
+import ledger
+
+# Bulk loader behind POST /api/import. Rows are parsed as a stream (CSV for one table,
+# or NDJSON records shaped like /api/all-data/stream output) and validated against the
+# schema. Each batch is written with executemany in its own short transaction, opened
+# only once the batch is parsed, so a slow upload never holds the write lock. The
+# revenue rollup and search index are updated for each batch's rows inside that
+# transaction; balance maintenance (and, optionally, secondary indexes) are deferred
+# until the last batch.
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+HISTORY_TABLES = {
+    'statusHistory': 'member_status_history',
+    'monthlyFeeHistory': 'member_monthly_fee_history',
+    'paymentCycleDayHistory': 'member_payment_cycle_day_history',
+}
+# Flush order matters: members must exist before rows that reference them
+TABLE_SQL = {
+    'members': """
+        INSERT INTO members (id, name, gender, mobile, email, cnic, admissionFee, joinDate)
+        VALUES (:id, :name, :gender, :mobile, :email, :cnic, :admissionFee, :joinDate)
+        ON CONFLICT(id) DO UPDATE SET
+            name = excluded.name, gender = excluded.gender, mobile = excluded.mobile, email = excluded.email,
+            cnic = excluded.cnic, admissionFee = excluded.admissionFee, joinDate = excluded.joinDate
+    """,
+    **{table_name: f"""
+        INSERT INTO {table_name} (id, memberId, value, effectiveDate) VALUES (:id, :memberId, :value, :effectiveDate)
+        ON CONFLICT(id) DO UPDATE SET memberId = excluded.memberId, value = excluded.value, effectiveDate = excluded.effectiveDate
+    """ for table_name in HISTORY_TABLES.values()},
+    'payments': """
+        INSERT INTO payments (id, memberId, date, appliedToPeriodStartDate, paymentType, amount)
+        VALUES (:id, :memberId, :date, :appliedToPeriodStartDate, :paymentType, :amount)
+        ON CONFLICT(id) DO UPDATE SET
+            memberId = excluded.memberId, date = excluded.date,
+            appliedToPeriodStartDate = excluded.appliedToPeriodStartDate,
+            paymentType = excluded.paymentType, amount = excluded.amount
+    """,
+    'writeoffs': """
+        INSERT INTO writeoffs (id, memberId, periodStartDate, periodEndDate, amount, date, notes)
+        VALUES (:id, :memberId, :periodStartDate, :periodEndDate, :amount, :date, :notes)
+        ON CONFLICT(id) DO UPDATE SET
+            memberId = excluded.memberId, periodStartDate = excluded.periodStartDate, periodEndDate = excluded.periodEndDate,
+            amount = excluded.amount, date = excluded.date, notes = excluded.notes
+    """,
+}
+# Revenue of the given payments (by id) and of every payment of the given members, added
+# (sign=1) or removed (sign=-1) from monthly_revenue; run before and after a batch is written
+BATCH_REVENUE_SQL = """
+    INSERT INTO monthly_revenue (year, month, paymentType, gender, total, paymentCount)
+    SELECT CAST(substr(p.appliedToPeriodStartDate, 1, 4) AS INTEGER), CAST(substr(p.appliedToPeriodStartDate, 6, 2) AS INTEGER),
+           p.paymentType, COALESCE(m.gender, ''), :sign * SUM(p.amount), :sign * COUNT(*)
+    FROM payments p JOIN members m ON m.id = p.memberId
+    WHERE (p.id IN (SELECT value FROM json_each(:paymentIds)) OR p.memberId IN (SELECT value FROM json_each(:memberIds)))
+      AND p.appliedToPeriodStartDate GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT(year, month, paymentType, gender) DO UPDATE SET
+        total = total + excluded.total, paymentCount = paymentCount + excluded.paymentCount
+"""
+CHANGE_ENTITIES = {'members': 'member', 'payments': 'payment', 'writeoffs': 'writeoff'}
+RECORD_TYPES = {'member': 'members', 'members': 'members', 'payment': 'payments', 'payments': 'payments',
+                'writeoff': 'writeoffs', 'writeoffs': 'writeoffs'}
+
+
+class RowError(ValueError):
+    pass
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and value.strip() == '')
+
+
+def _text(row, field, required=False):
+    value = row.get(field)
+    if _blank(value):
+        if required:
+            raise RowError(f"{field} is required")
+        return None
+    return str(value).strip()
+
+
+def _date(row, field, required=True):
+    value = _text(row, field, required)
+    if value is not None and not ledger.parse_date(value):
+        raise RowError(f"{field} must be a date in YYYY-MM-DD format")
+    return value
+
+
+def _number(row, field, required=True):
+    value = row.get(field)
+    if _blank(value):
+        if required:
+            raise RowError(f"{field} is required")
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{field} must be a number")
+
+
+def _member_rows(row, known_member_ids):
+    member = {
+        'id': _text(row, 'id') or db_utils.generate_id(),
+        'name': _text(row, 'name', required=True),
+        'gender': _text(row, 'gender'),
+        'mobile': _text(row, 'mobile'),
+        'email': _text(row, 'email'),
+        'cnic': _text(row, 'cnic'),
+        'admissionFee': _number(row, 'admissionFee', required=False),
+        'joinDate': _date(row, 'joinDate'),
+    }
+    rows = [('members', member)]
+
+    is_new = member['id'] not in known_member_ids
+    for key, table_name in HISTORY_TABLES.items():
+        entries = row.get(key)
+        if isinstance(entries, list):
+            for entry in entries:
+                rows.append((table_name, _history_row(entry, member['id'], key)))
+        elif is_new:
+            # Flat CSV columns seed one history entry at the join date for new members
+            flat_field = {'statusHistory': 'status', 'monthlyFeeHistory': 'monthlyFee',
+                          'paymentCycleDayHistory': 'paymentCycleDay'}[key]
+            if not _blank(row.get(flat_field)):
+                rows.append((table_name, _history_row(
+                    {'value': row[flat_field], 'effectiveDate': member['joinDate']}, member['id'], key)))
+    return rows
+
+
+def _history_row(entry, member_id, key):
+    if not isinstance(entry, dict):
+        raise RowError(f"{key} entries must be objects")
+    if key == 'statusHistory':
+        value = _text(entry, 'value', required=True)
+    elif key == 'monthlyFeeHistory':
+        value = _number(entry, 'value')
+    else:
+        value = _number(entry, 'value')
+        if value != int(value) or not 1 <= value <= 31:
+            raise RowError("paymentCycleDay must be a whole number between 1 and 31")
+        value = int(value)
+    return {'id': _text(entry, 'id') or db_utils.generate_id(), 'memberId': member_id,
+            'value': value, 'effectiveDate': _date(entry, 'effectiveDate')}
+
+
+def _payment_row(row):
+    return {
+        'id': _text(row, 'id') or db_utils.generate_id(),
+        'memberId': _text(row, 'memberId', required=True),
+        'date': _date(row, 'date'),
+        'appliedToPeriodStartDate': _date(row, 'appliedToPeriodStartDate', required=False),
+        'paymentType': _text(row, 'paymentType', required=True),
+        'amount': _number(row, 'amount'),
+    }
+
+
+def _writeoff_row(row):
+    writeoff = {
+        'id': _text(row, 'id') or db_utils.generate_id(),
+        'memberId': _text(row, 'memberId', required=True),
+        'periodStartDate': _date(row, 'periodStartDate'),
+        'periodEndDate': _date(row, 'periodEndDate'),
+        'amount': _number(row, 'amount'),
+        'date': _date(row, 'date'),
+        'notes': _text(row, 'notes'),
+    }
+    if writeoff['periodEndDate'] < writeoff['periodStartDate']:
+        raise RowError("periodEndDate is before periodStartDate")
+    return writeoff
+
+
+def _iter_csv(stream, record_type):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield reader.line_num, record_type, row
+
+
+def _iter_ndjson(stream, record_type):
+    for line_number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8-sig'), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, None, RowError("Invalid JSON")
+            continue
+        if isinstance(record, dict) and 'data' in record and 'type' in record:
+            yield line_number, record['type'], record['data']
+        else:
+            yield line_number, record.get('type', record_type) if isinstance(record, dict) else record_type, record
+
+
+def _drop_secondary_indexes(conn, table_names):
+    placeholders = ', '.join(['?'] * len(table_names))
+    indexes = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})",
+        list(table_names)).fetchall()
+    # Recorded in the same transaction as the drop, so startup can recreate them if this import dies
+    conn.executemany("INSERT OR REPLACE INTO deferred_indexes (name, sql) VALUES (?, ?)",
+                     [(index['name'], index['sql']) for index in indexes])
+    for index in indexes:
+        conn.execute(f"DROP INDEX IF EXISTS {index['name']}")
+    conn.commit()
+    return [index['name'] for index in indexes]
+
+
+def _write_batch(conn, pending):
+    """Writes one parsed batch, keeping monthly_revenue and members_fts in step, in the caller's transaction."""
+    member_ids = json.dumps([row['id'] for row in pending['members']])
+    # Members whose gender changes move all their payments to another revenue bucket
+    new_genders = {row['id']: row['gender'] for row in pending['members']}
+    regendered = [row['id'] for row in conn.execute(
+        "SELECT id, gender FROM members WHERE id IN (SELECT value FROM json_each(?))", (member_ids,))
+        if row['gender'] != new_genders[row['id']]]
+    revenue_params = {'paymentIds': json.dumps([row['id'] for row in pending['payments']]),
+                      'memberIds': json.dumps(regendered)}
+    touches_revenue = bool(pending['payments'] or regendered)
+    if touches_revenue:
+        conn.execute(BATCH_REVENUE_SQL, dict(revenue_params, sign=-1))
+
+    for table_name, rows in pending.items():
+        if rows:
+            conn.executemany(TABLE_SQL[table_name], rows)
+            if table_name in CHANGE_ENTITIES:
+                conn.executemany("INSERT INTO change_log (entity, entityId, op) VALUES (?, ?, 'upsert')",
+                                 [(CHANGE_ENTITIES[table_name], row['id']) for row in rows])
+
+    if touches_revenue:
+        conn.execute(BATCH_REVENUE_SQL, dict(revenue_params, sign=1))
+        conn.execute("DELETE FROM monthly_revenue WHERE paymentCount <= 0")
+    if pending['members']:
+        conn.execute("INSERT OR IGNORE INTO member_search_keys (memberId) SELECT value FROM json_each(?)", (member_ids,))
+        conn.execute("DELETE FROM members_fts WHERE rowid IN (SELECT docId FROM member_search_keys WHERE memberId IN (SELECT value FROM json_each(?)))",
+                     (member_ids,))
+        conn.execute(f"INSERT INTO members_fts (rowid, memberId, name, mobile, email, cnic, digits) "
+                     f"{database_setup.MEMBER_SEARCH_SELECT_SQL} WHERE m.id IN (SELECT value FROM json_each(?))", (member_ids,))
+
+
+def import_rows(stream, data_format='ndjson', record_type=None, defer_indexes=False):
+    started = time.perf_counter()
+    parse = _iter_csv if data_format == 'csv' else _iter_ndjson
+    report = {'rowsRead': 0, 'rowsImported': 0, 'errorCount': 0, 'errors': [],
+              'imported': {'members': 0, 'payments': 0, 'writeoffs': 0}}
+
+    def record_error(line_number, message):
+        report['errorCount'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line_number, 'error': message})
+
+    with db_utils.get_db_connection() as conn:
+        known_member_ids = {row['id'] for row in conn.execute('SELECT id FROM members')}
+        dropped_indexes = _drop_secondary_indexes(conn, TABLE_SQL.keys()) if defer_indexes else []
+        pending = {table_name: [] for table_name in TABLE_SQL}
+        batch = {'rows': 0, 'imported': dict.fromkeys(report['imported'], 0), 'memberIds': set()}
+        committed_member_ids = set()
+
+        def flush():
+            # Counts only reach the report once the batch has committed
+            try:
+                if batch['rows']:
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        _write_batch(conn, pending)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    report['rowsImported'] += batch['rows']
+                    for table_name, count in batch['imported'].items():
+                        report['imported'][table_name] += count
+                    committed_member_ids.update(batch['memberIds'])
+            finally:
+                for rows in pending.values():
+                    rows.clear()
+                batch['rows'] = 0
+                batch['imported'] = dict.fromkeys(batch['imported'], 0)
+                batch['memberIds'] = set()
+
+        line_number = None
+        try:
+            for line_number, row_type, row in parse(stream, record_type):
+                if row_type == 'meta':
+                    continue
+                report['rowsRead'] += 1
+                try:
+                    if isinstance(row, RowError):
+                        raise row
+                    if not isinstance(row, dict):
+                        raise RowError("Row must be an object")
+                    table_name = RECORD_TYPES.get(row_type)
+                    if table_name is None:
+                        raise RowError(f"Unknown record type {row_type!r}")
+                    if table_name == 'members':
+                        rows = _member_rows(row, known_member_ids)
+                        member_id = rows[0][1]['id']
+                    else:
+                        parsed = _payment_row(row) if table_name == 'payments' else _writeoff_row(row)
+                        member_id = parsed['memberId']
+                        if member_id not in known_member_ids:
+                            raise RowError(f"Unknown memberId {member_id}")
+                        rows = [(table_name, parsed)]
+                except RowError as e:
+                    record_error(line_number, str(e))
+                    continue
+
+                for target_table, parsed in rows:
+                    pending[target_table].append(parsed)
+                known_member_ids.add(member_id)
+                batch['memberIds'].add(member_id)
+                batch['rows'] += 1
+                batch['imported'][table_name] += 1
+
+                if sum(len(rows) for rows in pending.values()) >= BATCH_SIZE:
+                    flush()
+            flush()
+        except sqlite3.Error as e:
+            # Only the failing batch was rolled back; earlier batches stay imported and are reported
+            record_error(line_number, f"Import stopped, the last batch was rolled back: {e}")
+            report['stoppedEarly'] = True
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if dropped_indexes:
+                database_setup.restore_deferred_indexes(conn)
+                conn.execute("ANALYZE")
+                conn.commit()
+
+            # Deferred maintenance: one balance pass over the members whose rows were committed
+            affected = sorted(committed_member_ids)
+            for i in range(0, len(affected), 1000):
+                for member_id in affected[i:i + 1000]:
+                    ledger.refresh_member_balance(conn, member_id)
+                conn.commit()
+
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['rowsPerSecond'] = round(report['rowsImported'] / elapsed, 1) if elapsed > 0 else None
+    print(f"Import finished: {report['rowsImported']}/{report['rowsRead']} row(s) in {elapsed:.2f}s, "
+          f"{report['errorCount']} error(s).")
+    return report
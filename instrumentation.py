@@ -0,0 +1,265 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+# In-process metrics rendered in the Prometheus text format at /api/metrics. Each worker
+# process keeps its own registry, like any multi-process Prometheus target.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+BACKUP_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Opt-in: log every statement slower than this many milliseconds
+SLOW_QUERY_MS = float(os.environ['GYM_SLOW_QUERY_MS']) if os.environ.get('GYM_SLOW_QUERY_MS') else None
+BUSY_RETRIES = 3
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value:.6f}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.labels, self.buckets = name, help_text, labels, buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {series['count']}")
+        return lines
+
+
+HTTP_DURATION = Histogram('gym_http_request_duration_seconds', 'Request latency by route.',
+                          ('method', 'route', 'status'))
+HTTP_RESPONSE_BYTES = Histogram('gym_http_response_bytes', 'Response body size by route (unstreamed responses).',
+                                ('method', 'route'), SIZE_BUCKETS)
+HTTP_REQUEST_BYTES = Histogram('gym_http_request_bytes', 'Request body size by route.',
+                               ('method', 'route'), SIZE_BUCKETS)
+DB_QUERY_DURATION = Histogram('gym_db_query_duration_seconds', 'SQL statement time, including fetching its rows.',
+                              ('statement',))
+DB_QUERY_ROWS = Counter('gym_db_query_rows_total', 'Rows returned (reads) or changed (writes) by SQL statements.',
+                        ('statement',))
+DB_BUSY = Counter('gym_db_busy_total', 'SQLite busy/locked errors, by whether a retry got through.', ('outcome',))
+BACKUP_DURATION = Histogram('gym_backup_duration_seconds', 'Backup run time.', ('mode', 'outcome'), BACKUP_BUCKETS)
+STARTUP_SECONDS = Gauge('gym_startup_seconds', 'Time spent in each startup phase of this process.', ('phase',))
+
+REGISTRY = [HTTP_DURATION, HTTP_RESPONSE_BYTES, HTTP_REQUEST_BYTES, DB_QUERY_DURATION, DB_QUERY_ROWS, DB_BUSY,
+            BACKUP_DURATION, STARTUP_SECONDS]
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql):
+    """'select:members', 'insert:payments', ... -- bounded label values for SQL text."""
+    verb = re.match(r'\s*(\w+)', sql)
+    table = re.search(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+)', sql, re.IGNORECASE)
+    label = verb.group(1).lower() if verb else 'unknown'
+    return f"{label}:{table.group(1)}" if table else label
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times each statement from execute() until its rows are exhausted (or the next statement)."""
+
+    _query = None
+
+    def _start(self, sql):
+        self._finish()
+        self._query = [sql, time.perf_counter(), 0]
+
+    def _finish(self, rows=0):
+        query = self._query
+        if query is None:
+            return
+        self._query = None
+        sql, started, fetched = query
+        elapsed = time.perf_counter() - started
+        label = statement_label(sql)
+        row_count = fetched + rows if self.description else max(self.rowcount, 0)
+        DB_QUERY_DURATION.observe(elapsed, label)
+        DB_QUERY_ROWS.inc(label, amount=row_count)
+        if SLOW_QUERY_MS is not None and elapsed * 1000 >= SLOW_QUERY_MS:
+            print(f"Slow query ({elapsed * 1000:.1f} ms, {row_count} rows): {' '.join(sql.split())[:500]}")
+
+    def _run(self, method, sql, params):
+        was_in_transaction = self.connection.in_transaction
+        for attempt in range(BUSY_RETRIES + 1):
+            self._start(sql)
+            try:
+                method(sql, params)
+                break
+            except sqlite3.OperationalError as e:
+                self._query = None
+                # Only a statement that opened its transaction can be replayed on its own
+                if not _is_busy(e) or was_in_transaction or attempt == BUSY_RETRIES:
+                    if _is_busy(e):
+                        DB_BUSY.inc('failed')
+                    raise
+                DB_BUSY.inc('retried')
+                if self.connection.in_transaction:
+                    self.connection.rollback()
+                time.sleep(0.05 * (2 ** attempt))
+        if not self.description:
+            self._finish()
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(super().executemany, sql, seq_of_params)
+
+    def executescript(self, script):
+        self._start(script)
+        super().executescript(script)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._finish(1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if self._query is not None:
+            self._query[2] += len(rows)
+            if not rows:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._finish(len(rows))
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        if self._query is not None:
+            self._query[2] += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection factory whose statements all go through InstrumentedCursor."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+
+def observe_request(method, route, status, seconds, request_bytes, response_bytes):
+    HTTP_DURATION.observe(seconds, method, route, status)
+    if request_bytes:
+        HTTP_REQUEST_BYTES.observe(request_bytes, method, route)
+    if response_bytes is not None:
+        HTTP_RESPONSE_BYTES.observe(response_bytes, method, route)
+
+
+def observe_backup(mode, seconds, success):
+    BACKUP_DURATION.observe(seconds, mode, 'success' if success else 'failure')
+
+
+def observe_startup(phase, seconds):
+    STARTUP_SECONDS.set(seconds, phase)
+
+
+def render_metrics(pool_stats=None):
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    if pool_stats:
+        for metric, key, help_text in (('gym_db_pool_connections', 'size', 'Open pooled connections.'),
+                                       ('gym_db_pool_in_use', 'inUse', 'Pooled connections currently borrowed.'),
+                                       ('gym_db_pool_waits_total', 'waits', 'Acquires that had to wait for a connection.')):
+            kind = 'counter' if metric.endswith('_total') else 'gauge'
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for role in ('writers', 'readers'):
+                lines.append(f'{metric}{{pool="{role}"}} {pool_stats[role][key]}')
+    return '\n'.join(lines) + '\n'
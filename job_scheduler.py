@@ -0,0 +1,169 @@
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import database_utils as db_utils
+
+# Scheduler bookkeeping lives in its own SQLite file so that job-store writes (next run
+# times, job state) never take the application database's write lock. Every worker
+# process shares that store, but only the worker holding the leader lease runs jobs;
+# the others keep their scheduler paused and can still add, read and remove jobs.
+
+SCHEDULER_DB_PATH = os.environ.get(
+    'GYM_SCHEDULER_DB', os.path.join(os.path.dirname(__file__), 'gym_scheduler.sqlite'))
+SCHEDULER_DB_URL = os.environ.get('GYM_SCHEDULER_DB_URL', f'sqlite:///{SCHEDULER_DB_PATH}')
+LEGACY_JOBS_TABLE = 'apscheduler_jobs'
+
+LEASE_SECONDS = 30       # a leader that stops renewing is replaced after this long
+LEASE_RENEW_SECONDS = 5  # also how quickly the leader notices jobs added by other workers
+
+# Jobs here are backups and nightly maintenance; a handful of threads is plenty
+MAX_WORKERS = int(os.environ.get('GYM_SCHEDULER_WORKERS', '4'))
+JOB_DEFAULTS = {
+    'coalesce': True,           # a backlog of missed runs fires once, not once per missed run
+    'max_instances': 1,         # never run two copies of the same job at once
+    'misfire_grace_time': 3600, # still run a job up to an hour late (e.g. after a restart)
+}
+
+
+def create_scheduler():
+    """A scheduler backed by the dedicated job store, with per-job concurrency limits."""
+    # Imported here: APScheduler's SQLAlchemy job store is slow to import and only needed once the scheduler starts
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    jobstores = {
+        'default': SQLAlchemyJobStore(url=SCHEDULER_DB_URL,
+                                      engine_options={'connect_args': {'timeout': 30}})
+    }
+    executors = {
+        'default': {'type': 'threadpool', 'max_workers': MAX_WORKERS}
+    }
+    return BackgroundScheduler(jobstores=jobstores, executors=executors, job_defaults=JOB_DEFAULTS, daemon=True)
+
+
+def migrate_legacy_jobs(scheduler, legacy_db_path=db_utils.DB_PATH):
+    """Moves jobs persisted in the application database (the old job store) to the scheduler's store, once."""
+    if not os.path.exists(legacy_db_path):
+        return 0
+    conn = sqlite3.connect(legacy_db_path, timeout=30)
+    try:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (LEGACY_JOBS_TABLE,)).fetchone()
+        if not exists:
+            return 0
+
+        moved = failed = 0
+        for job_id, job_state in conn.execute(f"SELECT id, job_state FROM {LEGACY_JOBS_TABLE}").fetchall():
+            if scheduler.get_job(job_id, jobstore='default'):
+                continue # already migrated (or re-created) in the new store
+            try:
+                state = pickle.loads(job_state)
+                scheduler.add_job(
+                    state['func'], trigger=state['trigger'], args=state['args'], kwargs=state['kwargs'],
+                    id=job_id, name=state['name'], jobstore='default', replace_existing=True)
+                moved += 1
+                print(f"Migrated scheduled job '{job_id}' to {SCHEDULER_DB_URL}.")
+            except Exception as e:
+                print(f"Could not migrate scheduled job '{job_id}': {e}")
+                failed += 1
+
+        if not failed:
+            with conn:
+                conn.execute(f"DROP TABLE IF EXISTS {LEGACY_JOBS_TABLE}")
+        return moved
+    finally:
+        conn.close()
+
+
+@contextmanager
+def coordination_connection():
+    """Autocommit connection to the scheduler database, used for the leader lease and shared job state."""
+    conn = sqlite3.connect(SCHEDULER_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        yield conn
+    finally:
+        conn.close()
+
+
+class SchedulerLeader:
+    """Keeps the scheduler running in exactly one process via a renewable lease row."""
+
+    def __init__(self, scheduler, on_elected=None):
+        self.scheduler = scheduler
+        self.on_elected = on_elected
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._lease_expires = 0
+        self._stop = threading.Event()
+        self._thread = None
+        with coordination_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scheduler_leader (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    owner TEXT NOT NULL,
+                    expiresAt REAL NOT NULL
+                )
+            """)
+
+    def _renew(self):
+        now = time.time()
+        with coordination_connection() as conn:
+            # Take the lease if it is ours or has expired; otherwise leave it alone
+            conn.execute("""
+                INSERT INTO scheduler_leader (id, owner, expiresAt) VALUES (1, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET owner = excluded.owner, expiresAt = excluded.expiresAt
+                WHERE scheduler_leader.owner = excluded.owner OR scheduler_leader.expiresAt < ?
+            """, (self.owner, now + LEASE_SECONDS, now))
+            row = conn.execute("SELECT owner FROM scheduler_leader WHERE id = 1").fetchone()
+        if row['owner'] == self.owner:
+            self._lease_expires = now + LEASE_SECONDS
+            return True
+        return False
+
+    def tick(self):
+        try:
+            leader = self._renew()
+        except sqlite3.Error as e:
+            print(f"Scheduler lease renewal failed: {e}")
+            # Keep running only while the last lease we did get is still valid
+            leader = self.is_leader and time.time() < self._lease_expires
+
+        if leader and not self.is_leader:
+            print(f"Scheduler leader elected: {self.owner}")
+            self.is_leader = True
+            if self.on_elected:
+                self.on_elected()
+            self.scheduler.resume()
+        elif not leader and self.is_leader:
+            print(f"Scheduler leadership lost: {self.owner}")
+            self.is_leader = False
+            self.scheduler.pause()
+        elif leader:
+            # Pick up jobs other workers added or changed since the scheduler last woke
+            self.scheduler.wakeup()
+
+    def _run(self):
+        while not self._stop.wait(LEASE_RENEW_SECONDS):
+            self.tick()
+
+    def start(self):
+        self.tick() # decide right away so a single process starts running jobs immediately
+        self._thread = threading.Thread(target=self._run, name='scheduler-leader', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.is_leader:
+            self.is_leader = False
+            self.scheduler.pause()
+            # Hand over now instead of making the next leader wait for the lease to expire
+            with coordination_connection() as conn:
+                conn.execute("DELETE FROM scheduler_leader WHERE owner = ?", (self.owner,))
@@ -0,0 +1,409 @@
+import re
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from functools import lru_cache
+
+# Server-side port of the ledger logic in public/index.html (generateLedgerEntries,
+# getMemberOverdueAmount, getMemberOverdueDetails). Each member's histories, payments
+# and write-offs are loaded once with indexed queries, already sorted, and periods are
+# matched against them with binary search instead of re-filtering global arrays.
+
+DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def parse_date(value):
+    if not value or not isinstance(value, str) or not DATE_RE.match(value):
+        return None
+    return _parse_iso_date(value)
+
+
+@lru_cache(maxsize=8192)
+def _parse_iso_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _js_date(year, month_index, day):
+    # Mirrors Date.UTC(year, monthIndex, day), including overflow of day/month
+    year += month_index // 12
+    month_index %= 12
+    return date(year, month_index + 1, 1) + timedelta(days=day - 1)
+
+
+def _add_months(date_obj, months):
+    # Mirrors date.setUTCMonth(date.getUTCMonth() + months)
+    return _js_date(date_obj.year, date_obj.month - 1 + months, date_obj.day)
+
+
+def _days_between(start_date, end_date):
+    return abs((end_date - start_date).days) + 1
+
+
+def _js_round(value):
+    return int((value + 0.5) // 1)
+
+
+def _prorated_fee(monthly_fee, days):
+    fee = (monthly_fee / 30) * days
+    if fee > monthly_fee:
+        fee = monthly_fee
+    return _js_round(fee)
+
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class _History:
+    """A member history ordered by (effectiveDate, id) for effective-value lookups."""
+
+    def __init__(self, rows):
+        entries = [(parse_date(r['effectiveDate']), r['value']) for r in rows]
+        entries = [e for e in entries if e[0]]
+        # Rows arrive sorted by effectiveDate, id; the last entry on a date wins ties.
+        self.dates = [e[0] for e in entries]
+        self.values = [e[1] for e in entries]
+
+    def effective(self, target_date, default=None):
+        idx = bisect_right(self.dates, target_date) - 1
+        return self.values[idx] if idx >= 0 else default
+
+
+class _DatedRows:
+    """Rows sorted by a date column, queried by inclusive date ranges."""
+
+    def __init__(self, rows, key):
+        self.rows = [r for r in rows if parse_date(r[key])]
+        self.keys = [r[key] for r in self.rows]
+
+    def between(self, start_date, end_date):
+        lo = bisect_left(self.keys, start_date.isoformat())
+        hi = bisect_right(self.keys, end_date.isoformat())
+        return self.rows[lo:hi]
+
+    def on(self, date_str):
+        lo = bisect_left(self.keys, date_str)
+        hi = bisect_right(self.keys, date_str)
+        return self.rows[lo:hi]
+
+
+def load_member_ledger_data(conn, member_id):
+    cursor = conn.cursor()
+    member_row = cursor.execute('SELECT * FROM members WHERE id = ?', (member_id,)).fetchone()
+    if not member_row:
+        return None
+    history_sql = 'SELECT id, value, effectiveDate FROM {} WHERE memberId = ? ORDER BY effectiveDate, id'
+    return {
+        'member': dict(member_row),
+        'status': _History(cursor.execute(history_sql.format('member_status_history'), (member_id,)).fetchall()),
+        'fee': _History(cursor.execute(history_sql.format('member_monthly_fee_history'), (member_id,)).fetchall()),
+        'cycleDay': _History(cursor.execute(history_sql.format('member_payment_cycle_day_history'), (member_id,)).fetchall()),
+        'payments': _DatedRows([dict(r) for r in cursor.execute(
+            'SELECT * FROM payments WHERE memberId = ? AND appliedToPeriodStartDate IS NOT NULL '
+            'ORDER BY appliedToPeriodStartDate, id', (member_id,)).fetchall()], 'appliedToPeriodStartDate'),
+        'writeoffs': _DatedRows([dict(r) for r in cursor.execute(
+            'SELECT * FROM writeoffs WHERE memberId = ? ORDER BY periodStartDate, id',
+            (member_id,)).fetchall()], 'periodStartDate'),
+        'historyDates': [r[0] for r in cursor.execute("""
+            SELECT effectiveDate FROM member_status_history WHERE memberId = :id
+            UNION SELECT effectiveDate FROM member_monthly_fee_history WHERE memberId = :id
+            UNION SELECT effectiveDate FROM member_payment_cycle_day_history WHERE memberId = :id
+        """, {'id': member_id}).fetchall()],
+    }
+
+
+def _writeoffs_within(writeoffs, start_date, end_date):
+    end_str = end_date.isoformat()
+    start_str = start_date.isoformat()
+    return [w for w in writeoffs.between(start_date, end_date)
+            if parse_date(w['periodEndDate']) and start_str <= w['periodEndDate'] <= end_str]
+
+
+def _ledger_entry(start_date, end_date, fees_due, payments, writeoffs, status):
+    return {
+        'periodStartDate': start_date.isoformat(),
+        'periodEndDate': end_date.isoformat(),
+        'feesDue': fees_due,
+        'payments': payments,
+        'writeOffs': writeoffs,
+        'status': status,
+    }
+
+
+def generate_ledger_entries(data, projection_end):
+    member = data['member']
+    join_date = parse_date(member['joinDate'])
+    if not join_date:
+        print(f"Invalid joinDate for member: {member['id']}")
+        return []
+
+    status_history, fee_history, cycle_history = data['status'], data['fee'], data['cycleDay']
+    payments, writeoffs = data['payments'], data['writeoffs']
+
+    event_dates = {parse_date(d) for d in data['historyDates']}
+    event_dates.add(join_date)
+    event_dates.add(projection_end + timedelta(days=1))
+    sorted_event_dates = sorted(d for d in event_dates if d and d >= join_date)
+
+    entries = []
+    for i in range(len(sorted_event_dates) - 1):
+        segment_start = sorted_event_dates[i]
+        segment_end = sorted_event_dates[i + 1] - timedelta(days=1)
+
+        if segment_start > projection_end:
+            break
+        if segment_end > projection_end:
+            segment_end = projection_end
+        if segment_start > segment_end:
+            continue
+
+        status = status_history.effective(segment_start, 'Inactive')
+        monthly_fee = _to_float(fee_history.effective(segment_start, 0))
+        cycle_day = _to_int(cycle_history.effective(segment_start, 1))
+
+        if status == 'Inactive':
+            entries.append(_ledger_entry(
+                segment_start, segment_end, 0,
+                payments.between(segment_start, segment_end),
+                writeoffs.between(segment_start, segment_end),
+                'Inactive'))
+            continue
+
+        first_cycle_date = _js_date(segment_start.year, segment_start.month - 1, cycle_day)
+        if first_cycle_date < segment_start:
+            first_cycle_date = _add_months(first_cycle_date, 1)
+
+        current_start = segment_start
+        if segment_start < first_cycle_date:
+            initial_end = min(first_cycle_date - timedelta(days=1), segment_end)
+            if initial_end < segment_start:
+                initial_end = segment_start
+            entries.append(_ledger_entry(
+                segment_start, initial_end,
+                _prorated_fee(monthly_fee, _days_between(segment_start, initial_end)),
+                payments.between(segment_start, initial_end),
+                _writeoffs_within(writeoffs, segment_start, initial_end),
+                'Active'))
+            current_start = initial_end + timedelta(days=1)
+
+        while current_start <= segment_end:
+            period_start = _js_date(current_start.year, current_start.month - 1, cycle_day)
+            if current_start > period_start:
+                period_start = _add_months(period_start, 1)
+            if period_start < current_start:
+                period_start = current_start
+
+            period_end = _js_date(period_start.year, period_start.month, cycle_day) - timedelta(days=1)
+            if period_start < segment_start:
+                period_start = segment_start
+            if period_end > segment_end:
+                period_end = segment_end
+            if period_start > period_end or period_start > segment_end:
+                break
+
+            full_cycle_start = _js_date(period_start.year, period_start.month - 1, cycle_day)
+            full_cycle_end = _js_date(full_cycle_start.year, full_cycle_start.month, cycle_day) - timedelta(days=1)
+            if period_start == full_cycle_start and period_end == full_cycle_end and period_start >= join_date:
+                fees_due = monthly_fee
+            else:
+                fees_due = _prorated_fee(monthly_fee, _days_between(period_start, period_end))
+
+            entries.append(_ledger_entry(
+                period_start, period_end, fees_due,
+                payments.between(period_start, period_end),
+                _writeoffs_within(writeoffs, period_start, period_end),
+                'Active'))
+            current_start = period_end + timedelta(days=1)
+
+    if status_history.effective(projection_end, 'Inactive') == 'Active':
+        current_fee = _to_float(fee_history.effective(projection_end, 0))
+        current_cycle_day = _to_int(cycle_history.effective(projection_end, 1))
+
+        cycle_start = _js_date(projection_end.year, projection_end.month - 1, current_cycle_day)
+        if projection_end.day < current_cycle_day:
+            cycle_start = _add_months(cycle_start, -1)
+        if cycle_start < join_date:
+            cycle_start = join_date
+        cycle_end = _js_date(cycle_start.year, cycle_start.month, current_cycle_day) - timedelta(days=1)
+        cycle_start_str, cycle_end_str = cycle_start.isoformat(), cycle_end.isoformat()
+
+        def cycle_writeoffs():
+            return [w for w in writeoffs.on(cycle_start_str) if w['periodEndDate'] == cycle_end_str]
+
+        last_entry = entries[-1] if entries else None
+        if (last_entry
+                and parse_date(last_entry['periodStartDate']) <= cycle_start
+                and parse_date(last_entry['periodEndDate']) < cycle_end
+                and last_entry['status'] == 'Active'
+                and cycle_start <= projection_end):
+            # Extend a period cut short by the projection end to the full cycle
+            if last_entry['periodStartDate'] == cycle_start_str:
+                last_entry['periodEndDate'] = cycle_end_str
+                last_entry['feesDue'] = current_fee
+                last_entry['payments'] = payments.on(cycle_start_str)
+                last_entry['writeOffs'] = cycle_writeoffs()
+        elif ((not last_entry or parse_date(last_entry['periodEndDate']) < cycle_start)
+                and cycle_start <= projection_end):
+            already_covered = any(e['periodStartDate'] == cycle_start_str and e['periodEndDate'] == cycle_end_str
+                                  for e in entries)
+            if not already_covered:
+                entries.append({
+                    'periodStartDate': cycle_start_str,
+                    'periodEndDate': cycle_end_str,
+                    'feesDue': current_fee,
+                    'payments': payments.on(cycle_start_str),
+                    'writeOffs': cycle_writeoffs(),
+                    'status': 'Active',
+                })
+
+    entries.sort(key=lambda e: e['periodStartDate'])
+    unique_entries = []
+    seen_periods = set()
+    for entry in entries:
+        period_key = (entry['periodStartDate'], entry['periodEndDate'])
+        if period_key not in seen_periods:
+            unique_entries.append(entry)
+            seen_periods.add(period_key)
+    return unique_entries
+
+
+def _current_projection_end(data, today, default_cycle_day):
+    """End of the cycle containing today for active members, otherwise today."""
+    if data['status'].effective(today, 'Inactive') != 'Active':
+        return today
+    cycle_day = _to_int(data['cycleDay'].effective(today, default_cycle_day))
+    join_date = parse_date(data['member']['joinDate'])
+    if not join_date or not 1 <= cycle_day <= 31:
+        return today
+
+    cycle_start = _js_date(today.year, today.month - 1, cycle_day)
+    if today.day < cycle_day:
+        cycle_start = _add_months(cycle_start, -1)
+    if cycle_start < join_date:
+        cycle_start = join_date
+    cycle_end = _js_date(cycle_start.year, cycle_start.month, cycle_day) - timedelta(days=1)
+
+    if cycle_end < today and cycle_start <= today:
+        next_start = _js_date(today.year, today.month - 1, cycle_day)
+        if today.day >= cycle_day:
+            next_start = _add_months(next_start, 1)
+        cycle_end = next_start - timedelta(days=1)
+    return cycle_end if cycle_end >= today else today
+
+
+def _paid_amount(entry):
+    paid = sum(p['amount'] for p in entry['payments'] if p['paymentType'] == 'Monthly Fee')
+    return paid + sum(w['amount'] for w in entry['writeOffs'])
+
+
+def member_overdue_amount(data, today):
+    entries = generate_ledger_entries(data, _current_projection_end(data, today, 0))
+    fees_due = 0
+    paid = 0
+    for entry in entries:
+        start_date = parse_date(entry['periodStartDate'])
+        end_date = parse_date(entry['periodEndDate'])
+        if end_date < today or start_date <= today <= end_date:
+            fees_due += entry['feesDue']
+            paid += _paid_amount(entry)
+    return max(0, fees_due - paid)
+
+
+def _overdue_since(data, today):
+    entries = generate_ledger_entries(data, _current_projection_end(data, today, 1))
+    total_overdue = 0
+    first_unpaid_start = None
+    for entry in entries:
+        if entry['status'] == 'Inactive':
+            continue
+        balance = entry['feesDue'] - _paid_amount(entry)
+        if balance > 0:
+            total_overdue += balance
+            start_date = parse_date(entry['periodStartDate'])
+            if start_date <= today and (first_unpaid_start is None or start_date < first_unpaid_start):
+                first_unpaid_start = start_date
+    return total_overdue, first_unpaid_start
+
+
+def days_overdue(overdue_since, today):
+    if not overdue_since:
+        return 0
+    return max(0, (today - overdue_since).days + 1)
+
+
+def member_overdue_details(data, today):
+    total_overdue, first_unpaid_start = _overdue_since(data, today)
+    if total_overdue <= 0:
+        first_unpaid_start = None
+    return {'overdueAmount': max(0, total_overdue), 'daysOverdue': days_overdue(first_unpaid_start, today)}
+
+
+def _balance_valid_until(data, today):
+    """Last day on which a balance computed for today stays correct without writes."""
+    if data['status'].effective(today, 'Inactive') == 'Active':
+        valid_until = min(_current_projection_end(data, today, 0), _current_projection_end(data, today, 1))
+    else:
+        # Nothing accrues while inactive; only upcoming dated rows can change the balance
+        valid_until = date.max
+    today_str = today.isoformat()
+    upcoming = [data['member']['joinDate']] + list(data['historyDates'])
+    for rows in (data['payments'], data['writeoffs']):
+        idx = bisect_right(rows.keys, today_str)
+        if idx < len(rows.keys):
+            upcoming.append(rows.keys[idx])
+    for date_str in upcoming:
+        next_change = parse_date(date_str)
+        if next_change and next_change > today:
+            valid_until = min(valid_until, next_change - timedelta(days=1))
+    return valid_until
+
+
+def compute_member_balance(data, today):
+    status = data['status'].effective(today, 'Inactive')
+    total_overdue, first_unpaid_start = _overdue_since(data, today)
+    return {
+        'memberId': data['member']['id'],
+        'name': data['member']['name'],
+        'joinDate': data['member']['joinDate'],
+        'gender': data['member']['gender'],
+        'status': status,
+        'monthlyFee': _to_float(data['fee'].effective(today, 0)),
+        'overdueAmount': member_overdue_amount(data, today),
+        'overdueSince': first_unpaid_start.isoformat() if total_overdue > 0 and first_unpaid_start else None,
+        'asOfDate': today.isoformat(),
+        'validUntil': _balance_valid_until(data, today).isoformat(),
+    }
+
+
+def refresh_member_balance(conn, member_id, today=None):
+    """Recomputes one row of member_balances on the caller's connection/transaction."""
+    today = today or date.today()
+    data = load_member_ledger_data(conn, member_id)
+    if not data:
+        conn.execute('DELETE FROM member_balances WHERE memberId = ?', (member_id,))
+        return None
+    balance = compute_member_balance(data, today)
+    conn.execute("""
+        INSERT INTO member_balances (memberId, name, joinDate, gender, status, monthlyFee, overdueAmount, overdueSince,
+                                     asOfDate, validUntil)
+        VALUES (:memberId, :name, :joinDate, :gender, :status, :monthlyFee, :overdueAmount, :overdueSince,
+                :asOfDate, :validUntil)
+        ON CONFLICT(memberId) DO UPDATE SET
+            name = excluded.name, joinDate = excluded.joinDate,
+            gender = excluded.gender, status = excluded.status, monthlyFee = excluded.monthlyFee,
+            overdueAmount = excluded.overdueAmount, overdueSince = excluded.overdueSince,
+            asOfDate = excluded.asOfDate, validUntil = excluded.validUntil
+    """, balance)
+    return balance
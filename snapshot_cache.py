@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import database_utils as db_utils
+
+# Serialized /api/all-data snapshot shared by all request threads in this process.
+# It is keyed by the change_log version, which every writer in database_utils bumps in
+# its own transaction, so a write committed by any worker process invalidates it.
+# get_all_data reads that version and the rows from one read transaction, so a body is
+# never cached (or given an ETag) under a generation it does not fully reflect. A cached
+# body is reused only for exactly its own generation: after a restore the version can go
+# backwards, and a "newer" body would then be stale. For the same reason ETags carry a
+# hash of the body, not just the version, which a restored database can repeat.
+
+_snapshot = None
+_build_lock = threading.Lock()
+
+# /api/members/as-of results, most recently used last. An entry is reused only while its
+# generation is current, so the effective key is (date, write generation).
+AS_OF_CACHE_SIZE = 32
+_as_of_cache = OrderedDict()
+_as_of_lock = threading.Lock()
+
+
+def _etag(prefix, version, body):
+    return f"{prefix}-v{version}-{hashlib.sha256(body).hexdigest()[:16]}"
+
+
+def _build_snapshot():
+    started = time.perf_counter()
+    data = db_utils.get_all_data()
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    snapshot = {
+        'generation': data['version'],
+        'etag': _etag('all-data', data['version'], body),
+        'body': body,
+        'gzipBody': gzip.compress(body, compresslevel=6),
+    }
+    print(f"Built all-data snapshot v{snapshot['generation']}: {len(body)} bytes "
+          f"({len(snapshot['gzipBody'])} gzipped) in {time.perf_counter() - started:.3f}s")
+    return snapshot
+
+
+def get_snapshot():
+    global _snapshot
+    generation = db_utils.get_write_generation()
+    snapshot = _snapshot
+    if snapshot and snapshot['generation'] == generation:
+        return snapshot
+    with _build_lock:
+        # Requests that queued up behind the builder reuse its result
+        snapshot = _snapshot
+        if snapshot and snapshot['generation'] == generation:
+            return snapshot
+        _snapshot = _build_snapshot()
+        return _snapshot
+
+
+
+def get_members_as_of(as_of):
+    generation = db_utils.get_write_generation()
+    with _as_of_lock:
+        entry = _as_of_cache.get(as_of)
+        if entry and entry['generation'] == generation:
+            _as_of_cache.move_to_end(as_of)
+            return entry
+
+    data = db_utils.get_members_as_of(as_of)
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    entry = {
+        'generation': data['version'],
+        'etag': _etag(f'as-of-{as_of}', data['version'], body),
+        'body': body,
+        'gzipBody': gzip.compress(body, compresslevel=6),
+    }
+    with _as_of_lock:
+        _as_of_cache[as_of] = entry
+        _as_of_cache.move_to_end(as_of)
+        while len(_as_of_cache) > AS_OF_CACHE_SIZE:
+            _as_of_cache.popitem(last=False)
+    return entry
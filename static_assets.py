@@ -0,0 +1,218 @@
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The SPA's files are served from an in-memory route table built once per process. Every
+# file is reachable at its own path (revalidated with a strong ETag) and, except HTML, at a
+# fingerprinted path such as css/inter-font.3f2a9b1c4d.css that can be cached forever.
+# index.html and the CSS are rewritten to reference the fingerprinted paths. Compressed
+# variants are made on first use and kept in CACHE_DIR under the content hash;
+# `python static_assets.py` builds them all ahead of time and writes a manifest.
+
+PUBLIC_DIR = os.path.join(os.path.dirname(__file__), 'public')
+CACHE_DIR = os.environ.get('GYM_ASSET_CACHE', os.path.join(os.path.dirname(__file__), 'build', 'assets'))
+MANIFEST_FILE = 'manifest.json'
+
+HASH_LENGTH = 10
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+ENCODINGS = ('br', 'gzip') # in order of preference
+CACHE_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+MIN_COMPRESS_BYTES = 512
+# Formats that are already compressed gain nothing from another pass
+INCOMPRESSIBLE_EXTENSIONS = {'.woff2', '.woff', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.gz', '.br', '.zip'}
+EXTRA_MIMETYPES = {'.woff2': 'font/woff2', '.woff': 'font/woff', '.ttf': 'font/ttf', '.ico': 'image/x-icon'}
+
+CSS_URL_RE = re.compile(r'''(url\(\s*["']?)([^)"'\s]+)(["']?\s*\))''')
+HTML_REF_RE = re.compile(r'''(\b(?:src|href)=")([^"]+)(")''')
+
+_routes = None
+_routes_lock = threading.Lock()
+_compress_lock = threading.Lock()
+
+
+def _fingerprinted_path(path, digest):
+    root, ext = posixpath.splitext(path)
+    return f"{root}.{digest[:HASH_LENGTH]}{ext}"
+
+
+def _resolve(base_path, ref):
+    # Only plain relative or root-relative references to our own files are rewritten
+    if '://' in ref or ref.startswith(('//', '#', 'data:', 'mailto:')) or '?' in ref or '#' in ref:
+        return None
+    if ref.startswith('/'):
+        return posixpath.normpath(ref[1:])
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_path), ref))
+
+
+def _rewrite_references(path, body, pattern, fingerprints):
+    def replace(match):
+        target = _resolve(path, match.group(2))
+        if target not in fingerprints:
+            return match.group(0)
+        if match.group(2).startswith('/'):
+            new_ref = '/' + fingerprints[target]
+        else:
+            new_ref = posixpath.relpath(fingerprints[target], posixpath.dirname(path) or '.')
+        return match.group(1) + new_ref + match.group(3)
+
+    text = body.decode('utf-8', errors='surrogateescape')
+    return pattern.sub(replace, text).encode('utf-8', errors='surrogateescape')
+
+
+def _read_public_files(public_dir):
+    files = {}
+    for root, _, names in os.walk(public_dir):
+        for name in names:
+            full_path = os.path.join(root, name)
+            with open(full_path, 'rb') as f:
+                files[os.path.relpath(full_path, public_dir).replace(os.sep, '/')] = f.read()
+    return files
+
+
+def build_route_table(public_dir=PUBLIC_DIR):
+    """Maps request paths to assets: {body, sha256, etag, mimetype, compressible, variants, immutable}."""
+    files = _read_public_files(public_dir)
+    fingerprints = {}
+    assets = {}
+    # Fonts and images first, then the CSS that references them, then the HTML that references both
+    stages = {'.css': 1, '.html': 2, '.htm': 2}
+    for path in sorted(files, key=lambda p: (stages.get(posixpath.splitext(p)[1].lower(), 0), p)):
+        ext = posixpath.splitext(path)[1].lower()
+        stage = stages.get(ext, 0)
+        body = files[path]
+        if stage == 1:
+            body = _rewrite_references(path, body, CSS_URL_RE, fingerprints)
+        elif stage == 2:
+            body = _rewrite_references(path, body, HTML_REF_RE, fingerprints)
+        digest = hashlib.sha256(body).hexdigest()
+        assets[path] = {
+            'path': path,
+            'body': body,
+            'sha256': digest,
+            'etag': digest[:32],
+            'mimetype': EXTRA_MIMETYPES.get(ext) or mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'compressible': ext not in INCOMPRESSIBLE_EXTENSIONS and len(body) >= MIN_COMPRESS_BYTES,
+            'variants': {}, # encoding -> compressed body (None if not worth it), shared by both routes
+        }
+        if stage != 2:
+            fingerprints[path] = _fingerprinted_path(path, digest)
+
+    routes = {}
+    for path, asset in assets.items():
+        routes[path] = dict(asset, immutable=False)
+        if path in fingerprints:
+            routes[fingerprints[path]] = dict(asset, immutable=True)
+    return routes
+
+
+def load_routes(public_dir=PUBLIC_DIR):
+    """Builds (or rebuilds, after a deploy) the process-wide route table."""
+    global _routes
+    started = time.perf_counter()
+    routes = build_route_table(public_dir)
+    with _routes_lock:
+        _routes = routes
+    print(f"Static asset table built: {len(routes)} route(s) in {(time.perf_counter() - started) * 1000:.0f} ms.")
+    return routes
+
+
+def lookup(path):
+    routes = _routes if _routes is not None else load_routes()
+    return routes.get(path)
+
+
+def _compress(body, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(body, 9, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(body, quality=11)
+    return None
+
+
+def _load_or_compress(asset, encoding, cache_dir):
+    cache_path = os.path.join(cache_dir, asset['sha256'] + CACHE_SUFFIXES[encoding])
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return f.read()
+    data = _compress(asset['body'], encoding)
+    if data is None:
+        return None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"Could not cache {encoding} variant of {asset['path']}: {e}")
+    return data
+
+
+def get_variant(asset, encoding, cache_dir=CACHE_DIR):
+    """The asset's body in `encoding`, or None when that encoding is unavailable or no smaller."""
+    variants = asset['variants']
+    if encoding not in variants:
+        with _compress_lock:
+            if encoding not in variants:
+                data = _load_or_compress(asset, encoding, cache_dir)
+                variants[encoding] = data if data is not None and len(data) < len(asset['body']) else None
+    return variants[encoding]
+
+
+def select_encoding(asset, accept_encodings):
+    """(encoding, body) for the best encoding the client accepts; encoding is None for identity."""
+    if asset['compressible']:
+        for encoding in ENCODINGS:
+            if encoding in accept_encodings:
+                data = get_variant(asset, encoding)
+                if data is not None:
+                    return encoding, data
+    return None, asset['body']
+
+
+def build_assets(public_dir=PUBLIC_DIR, cache_dir=CACHE_DIR):
+    """Precompresses every asset into cache_dir and writes the manifest; returns the manifest."""
+    routes = build_route_table(public_dir)
+    manifest = {'createdAt': time.strftime('%Y-%m-%dT%H:%M:%S'), 'brotli': brotli is not None, 'assets': {}}
+    for route, asset in sorted(routes.items()):
+        entry = manifest['assets'].setdefault(asset['path'], {
+            'sha256': asset['sha256'], 'size': len(asset['body']), 'mimetype': asset['mimetype'],
+        })
+        if asset['immutable']:
+            entry['fingerprinted'] = route
+        if asset['compressible']:
+            for encoding in ENCODINGS:
+                data = get_variant(asset, encoding, cache_dir)
+                if data is not None:
+                    entry[f'{encoding}Size'] = len(data)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompress and fingerprint the SPA assets.')
+    parser.add_argument('--public', default=PUBLIC_DIR, help='Directory of source assets')
+    parser.add_argument('--cache', default=CACHE_DIR, help='Where compressed variants and the manifest go')
+    args = parser.parse_args()
+    started = time.perf_counter()
+    manifest = build_assets(args.public, args.cache)
+    assets = manifest['assets'].values()
+    print(f"Built {len(manifest['assets'])} asset(s) in {time.perf_counter() - started:.1f}s: "
+          f"{sum(a['size'] for a in assets)} bytes, "
+          f"{sum(a.get('gzipSize', a['size']) for a in assets)} gzipped"
+          + ('' if brotli is not None else ' (install brotli for .br variants)') + '.')
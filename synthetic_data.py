@@ -0,0 +1,211 @@
+import argparse
+import os
+import random
+import time
+from datetime import date, timedelta
+
+import database_setup
+import database_utils as db_utils
+
+# Seeded, production-sized datasets for benchmarking. Members have the same shape as the
+# sample_members in database_setup.init_db (plus years of history); payments and
+# write-offs follow each member's own status, fee and cycle-day history.
+
+FIRST_NAMES = {
+    'Male': ['Ali', 'Ahmed', 'Bilal', 'Hassan', 'Usman', 'Omar', 'Hamza', 'Zain', 'Fahad', 'Imran', 'Saad', 'Tariq'],
+    'Female': ['Aisha', 'Fatima', 'Sara', 'Zainab', 'Ayesha', 'Hira', 'Maryam', 'Sana', 'Nida', 'Amna', 'Iqra', 'Mahnoor'],
+}
+LAST_NAMES = ['Khan', 'Ahmed', 'Malik', 'Hussain', 'Qureshi', 'Sheikh', 'Butt', 'Chaudhry', 'Raza', 'Iqbal', 'Javed', 'Siddiqui']
+MONTHLY_FEES = [3000, 3500, 4000, 4500, 5000, 6000]
+ADMISSION_FEES = [0, 1000, 1500, 2000]
+BATCH_SIZE = 10000
+
+BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def synthetic_id(kind, n):
+    # Same '_' + 9 character shape as generate_id, but deterministic and collision-free
+    digits = ''
+    while True:
+        n, remainder = divmod(n, 36)
+        digits = BASE36[remainder] + digits
+        if n == 0:
+            break
+    return '_' + kind + digits.rjust(8, '0')
+
+
+def _month_start(day, months, cycle_day):
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, min(cycle_day, 28))
+
+
+def _effective(history, on_date, default=None):
+    value = default
+    for entry in history:
+        if entry['effectiveDate'] <= on_date:
+            value = entry['value']
+    return value
+
+
+def make_member(seed, index, today, years):
+    """One member in the sample_members shape, reproducible from (seed, index)."""
+    rng = random.Random(seed * 1_000_003 + index)
+    gender = rng.choice(['Male', 'Female'])
+    first, last = rng.choice(FIRST_NAMES[gender]), rng.choice(LAST_NAMES)
+    join = today - timedelta(days=rng.randint(1, max(1, int(years * 365))))
+    join_str = join.isoformat()
+    ids = iter(range(index * 100, index * 100 + 100))
+
+    def entry(value, on_date):
+        return {'id': synthetic_id('h', next(ids)), 'value': value, 'effectiveDate': on_date.isoformat()}
+
+    status_history = [entry('Active', join)]
+    if rng.random() < 0.3:
+        left = join + timedelta(days=rng.randint(30, max(31, (today - join).days)))
+        if left < today:
+            status_history.append(entry('Inactive', left))
+            if rng.random() < 0.4:
+                returned = left + timedelta(days=rng.randint(30, 400))
+                if returned < today:
+                    status_history.append(entry('Active', returned))
+
+    fee = rng.choice(MONTHLY_FEES)
+    fee_history = [entry(fee, join)]
+    for year in range(1, int(years) + 1):
+        raised_on = join + timedelta(days=365 * year)
+        if raised_on < today and rng.random() < 0.5:
+            fee += 500
+            fee_history.append(entry(fee, raised_on))
+
+    cycle_day_history = [entry(join.day, join)]
+    if rng.random() < 0.1:
+        changed_on = join + timedelta(days=rng.randint(30, max(31, (today - join).days)))
+        if changed_on < today:
+            cycle_day_history.append(entry(rng.randint(1, 28), changed_on))
+
+    return {
+        'id': synthetic_id('m', index), 'name': f"{first} {last}", 'gender': gender,
+        'mobile': f"03{rng.randint(0, 999999999):09d}", 'email': f"{first}.{last}{index}@example.com".lower(),
+        'cnic': f"{rng.randint(10000, 99999)}-{rng.randint(0, 9999999):07d}-{rng.randint(1, 9)}",
+        'admissionFee': rng.choice(ADMISSION_FEES), 'joinDate': join_str,
+        'monthlyFeeHistory': fee_history, 'statusHistory': status_history,
+        'paymentCycleDayHistory': cycle_day_history,
+        '_rng': rng,
+    }
+
+
+def _billable_periods(member, today):
+    """(start, end, fee) for each monthly period in which the member was Active."""
+    join = date.fromisoformat(member['joinDate'])
+    periods = []
+    months = 0
+    while True:
+        cycle_day = _effective(member['paymentCycleDayHistory'], _month_start(join, months, 28).isoformat(), join.day)
+        start = _month_start(join, months, cycle_day)
+        if start > today:
+            break
+        end = _month_start(join, months + 1, cycle_day) - timedelta(days=1)
+        start_str = start.isoformat()
+        if start >= join and _effective(member['statusHistory'], start_str, 'Inactive') == 'Active':
+            periods.append((start, end, _effective(member['monthlyFeeHistory'], start_str, 0)))
+        months += 1
+    return periods
+
+
+def generate_dataset(db_path, members=1000, payments=None, years=3, seed=42, today=None):
+    """Fills an empty database at db_path. `payments` (approximate total) sets how often periods are paid."""
+    today = today or date.today()
+    started = time.perf_counter()
+    database_setup.DB_PATH = db_utils.DB_PATH = db_path
+    database_setup.init_db(populate_with_sample_data=False)
+    conn = database_setup.get_db_connection()
+    if conn.execute("SELECT COUNT(*) FROM members").fetchone()[0]:
+        conn.close()
+        raise ValueError(f"{db_path} already contains members; generate into an empty database.")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    pay_rate = 0.92
+    if payments:
+        # First pass: count billable periods so the requested payment total can be hit
+        periods = admissions = 0
+        for index in range(members):
+            member = make_member(seed, index, today, years)
+            periods += len(_billable_periods(member, today))
+            admissions += member['admissionFee'] > 0
+        pay_rate = min(1.0, max(0.0, (payments - admissions) / periods)) if periods else 0.0
+
+    counts = {'members': 0, 'history': 0, 'payments': 0, 'writeoffs': 0}
+    rows = {'members': [], 'member_status_history': [], 'member_monthly_fee_history': [],
+            'member_payment_cycle_day_history': [], 'payments': [], 'writeoffs': []}
+    sql = {
+        'members': "INSERT INTO members (id, name, gender, mobile, email, cnic, admissionFee, joinDate) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        'payments': "INSERT INTO payments (id, memberId, date, appliedToPeriodStartDate, paymentType, amount) VALUES (?, ?, ?, ?, ?, ?)",
+        'writeoffs': "INSERT INTO writeoffs (id, memberId, periodStartDate, periodEndDate, amount, date, notes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+    }
+    history_keys = {'statusHistory': 'member_status_history', 'monthlyFeeHistory': 'member_monthly_fee_history',
+                    'paymentCycleDayHistory': 'member_payment_cycle_day_history'}
+
+    def flush():
+        for table_name, table_rows in rows.items():
+            if table_rows:
+                statement = sql.get(table_name) or f"INSERT INTO {table_name} (id, memberId, value, effectiveDate) VALUES (?, ?, ?, ?)"
+                conn.executemany(statement, table_rows)
+                table_rows.clear()
+        conn.commit()
+
+    for index in range(members):
+        member = make_member(seed, index, today, years)
+        rng = member.pop('_rng')
+        rows['members'].append((member['id'], member['name'], member['gender'], member['mobile'], member['email'],
+                                member['cnic'], member['admissionFee'], member['joinDate']))
+        for key, table_name in history_keys.items():
+            for h_entry in member[key]:
+                rows[table_name].append((h_entry['id'], member['id'], h_entry['value'], h_entry['effectiveDate']))
+                counts['history'] += 1
+        if member['admissionFee'] > 0:
+            rows['payments'].append((synthetic_id('p', counts['payments']), member['id'], member['joinDate'],
+                                     member['joinDate'], 'Admission Fee', member['admissionFee']))
+            counts['payments'] += 1
+        for start, end, fee in _billable_periods(member, today):
+            if rng.random() < pay_rate:
+                paid_on = min(today, start + timedelta(days=rng.randint(0, 10)))
+                rows['payments'].append((synthetic_id('p', counts['payments']), member['id'], paid_on.isoformat(),
+                                         start.isoformat(), 'Monthly Fee', fee))
+                counts['payments'] += 1
+            elif end < today and rng.random() < 0.1:
+                rows['writeoffs'].append((synthetic_id('w', counts['writeoffs']), member['id'], start.isoformat(),
+                                          end.isoformat(), fee, end.isoformat(), 'Synthetic write-off'))
+                counts['writeoffs'] += 1
+        counts['members'] += 1
+        if sum(len(table_rows) for table_rows in rows.values()) >= BATCH_SIZE:
+            flush()
+        if counts['members'] % 10000 == 0:
+            print(f"Generated {counts['members']}/{members} members, {counts['payments']} payments...")
+    flush()
+
+    # Derived tables, exactly as the app maintains them
+    database_setup.rebuild_monthly_revenue(conn)
+    database_setup.rebuild_member_search(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    db_utils.set_connection_manager(None)
+    db_utils.roll_forward_balances(today)
+    db_utils.close_connections()
+
+    counts['seconds'] = round(time.perf_counter() - started, 1)
+    print(f"Synthetic dataset written to {db_path}: {counts}")
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a seeded synthetic gym database.')
+    parser.add_argument('--db', required=True, help='Path of the (new or empty) database to fill')
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--payments', type=int, help='Approximate number of payments (default: ~92%% of billable periods)')
+    parser.add_argument('--years', type=float, default=3, help='Years of membership history')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        parser.exit(1, f"{args.db} already exists; choose a new path.\n")
+    generate_dataset(args.db, args.members, args.payments, args.years, args.seed)